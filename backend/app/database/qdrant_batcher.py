@@ -0,0 +1,112 @@
+# backend/app/database/qdrant_batcher.py
+"""
+Micro-batching layer for Qdrant searches.
+Coalesces concurrent searches into a single query_batch_points call.
+"""
+import logging
+from typing import List, Optional
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Filter,
+    QueryRequest,
+    ScoredPoint,
+    SearchParams,
+    QuantizationSearchParams,
+)
+from app.utils.micro_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+# Batching configuration
+MAX_BATCH_SIZE = 16  # Requests per query_batch_points call
+MAX_WAIT_SECONDS = 0.005  # Window to collect concurrent searches
+
+# Search quantized vectors, then rescore candidates with full precision
+SEARCH_PARAMS = SearchParams(
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
+
+class QdrantSearchBatcher(MicroBatcher):
+    """
+    Collects pending searches from concurrent requests and issues them
+    as one query_batch_points round-trip per collection.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT_SECONDS
+    ):
+        super().__init__(max_batch_size, max_wait)
+
+    async def search(
+        self,
+        client: AsyncQdrantClient,
+        collection_name: str,
+        vector: List[float],
+        query_filter: Optional[Filter] = None,
+        limit: int = 5
+    ) -> List[ScoredPoint]:
+        """
+        Queue a search and wait for its result.
+
+        Args:
+            client: Async Qdrant client instance
+            collection_name: Qdrant collection name
+            vector: Query embedding
+            query_filter: Optional payload filter (e.g. user_id scoping)
+            limit: Maximum number of results
+
+        Returns:
+            List of scored points with payload
+        """
+        request = QueryRequest(
+            query=vector,
+            filter=query_filter,
+            limit=limit,
+            params=SEARCH_PARAMS,
+            with_payload=True
+        )
+        return await self._submit((client, collection_name, request))
+
+    async def _flush(self, batch: list) -> None:
+        """Issue one query_batch_points call per collection in the batch."""
+        groups = {}
+        for (client, collection_name, request), future in batch:
+            key = (id(client), collection_name)
+            groups.setdefault(key, (client, []))[1].append((request, future))
+
+        for (_, collection_name), (client, items) in groups.items():
+            try:
+                responses = await client.query_batch_points(
+                    collection_name=collection_name,
+                    requests=[request for request, _ in items]
+                )
+
+                for (_, future), response in zip(items, responses):
+                    if not future.done():
+                        future.set_result(response.points)
+
+                logger.info(f"🔍 Batched {len(items)} searches on '{collection_name}'")
+
+            except Exception as e:
+                logger.error(f"❌ Batched search failed: {e}")
+                self._fail(items, e)
+
+
+# Singleton instance
+_search_batcher = None
+
+
+def get_search_batcher() -> QdrantSearchBatcher:
+    """
+    Get singleton search batcher instance.
+    Initializes on first call, returns cached instance thereafter.
+    """
+    global _search_batcher
+
+    if _search_batcher is None:
+        _search_batcher = QdrantSearchBatcher()
+
+    return _search_batcher
@@ -4,8 +4,16 @@ Qdrant client for vector database operations.
 Handles embedding storage and retrieval with user-scoped filtering.
 """
 import os
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+import threading
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Distance,
+    VectorParams,
+    HnswConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+)
 import logging
 from dotenv import load_dotenv
 
@@ -15,24 +23,47 @@ logger = logging.getLogger(__name__)
 # Environment variables
 QDRANT_URL = os.getenv("QDRANT_URL", "")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", "")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "100"))
+QDRANT_USE_MEMORY = os.getenv("QDRANT_USE_MEMORY", "0") == "1"
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 
 # Collection configuration
 DEFAULT_COLLECTION_NAME = "multimodal_docs"
 EMBEDDING_DIMENSION = 384  # all-MiniLM-L6-v2 produces 384-dim vectors
+HNSW_M = 16
+HNSW_EF_CONSTRUCT = 128
 
+# int8 scalar quantization kept in RAM for hot distance computation
+QUANTIZATION_CONFIG = ScalarQuantization(
+    scalar=ScalarQuantizationConfig(
+        type=ScalarType.INT8,
+        quantile=0.99,
+        always_ram=True
+    )
+)
 
-def get_qdrant_client() -> QdrantClient | None:
+# Collections already verified/created in this process
+_ensured: set[str] = set()
+
+
+def get_qdrant_client() -> AsyncQdrantClient | None:
     """
-    Get Qdrant client for vector operations.
+    Get async Qdrant client for vector operations.
     
     Returns:
-        QdrantClient instance or None if not configured
+        AsyncQdrantClient instance or None if not configured
         
     Note:
         - For Qdrant Cloud: Requires both URL and API_KEY
         - For local: Only requires URL (usually http://localhost:6333)
+        - Uses gRPC transport with a pooled connection (QDRANT_POOL_SIZE)
+        - QDRANT_USE_MEMORY=1 opts into a local in-memory instance (dev/tests)
     """
+    if QDRANT_USE_MEMORY:
+        logger.info("✅ Qdrant client initialized (in-memory)")
+        return AsyncQdrantClient(location=":memory:")
+    
     if not QDRANT_URL:
         logger.warning(
             "⚠️ Qdrant not configured. "
@@ -43,7 +74,12 @@ def get_qdrant_client() -> QdrantClient | None:
     try:
         # If URL is localhost, don't require API key
         if "localhost" in QDRANT_URL or "127.0.0.1" in QDRANT_URL:
-            client = QdrantClient(url=QDRANT_URL)
+            client = AsyncQdrantClient(
+                url=QDRANT_URL,
+                prefer_grpc=True,
+                grpc_port=QDRANT_GRPC_PORT,
+                pool_size=QDRANT_POOL_SIZE
+            )
             logger.info(f"✅ Qdrant client initialized (local): {QDRANT_URL}")
         else:
             # Cloud instance requires API key
@@ -51,9 +87,13 @@ def get_qdrant_client() -> QdrantClient | None:
                 logger.warning("⚠️ QDRANT_API_KEY required for cloud instance")
                 return None
             
-            client = QdrantClient(
+            client = AsyncQdrantClient(
                 url=QDRANT_URL,
-                api_key=QDRANT_API_KEY
+                api_key=QDRANT_API_KEY,
+                https=True,
+                prefer_grpc=True,
+                grpc_port=QDRANT_GRPC_PORT,
+                pool_size=QDRANT_POOL_SIZE
             )
             logger.info(f"✅ Qdrant client initialized (cloud): {QDRANT_URL}")
         
@@ -64,47 +104,69 @@ def get_qdrant_client() -> QdrantClient | None:
         return None
 
 
-def ensure_collection(
-    client: QdrantClient,
+async def ensure_collection(
+    client: AsyncQdrantClient,
     collection_name: str = DEFAULT_COLLECTION_NAME,
     dimension: int = EMBEDDING_DIMENSION,
-    distance: Distance = Distance.COSINE
+    distance: Distance = Distance.DOT
 ) -> bool:
     """
     Ensure collection exists with proper configuration.
     Creates collection if it doesn't exist.
     
     Args:
-        client: Qdrant client instance
+        client: Async Qdrant client instance
         collection_name: Name of the collection
         dimension: Vector dimension (default: 384 for all-MiniLM-L6-v2)
-        distance: Distance metric (default: COSINE)
+        distance: Distance metric (default: DOT; embeddings are L2-normalized,
+                  so dot product equals cosine similarity)
         
     Returns:
         True if collection exists or was created successfully
     """
+    if collection_name in _ensured:
+        return True
+    
     try:
         # Check if collection exists
-        collections = client.get_collections().collections
-        collection_names = [col.name for col in collections]
-        
-        if collection_name in collection_names:
+        if await client.collection_exists(collection_name):
+            # Collections created before quantization was enabled get it now;
+            # Qdrant builds the int8 copies in the background
+            info = await client.get_collection(collection_name)
+            if info.config.quantization_config is None:
+                await client.update_collection(
+                    collection_name=collection_name,
+                    quantization_config=QUANTIZATION_CONFIG
+                )
+                logger.info(f"✅ Enabled int8 quantization on existing collection '{collection_name}'")
+            
+            _ensured.add(collection_name)
             logger.info(f"✅ Collection '{collection_name}' already exists")
             return True
         
         # Create collection
-        client.create_collection(
+        await client.create_collection(
             collection_name=collection_name,
+            # Full-precision vectors, HNSW graph and payload live on disk (mmap)
             vectors_config=VectorParams(
                 size=dimension,
-                distance=distance
-            )
+                distance=distance,
+                on_disk=True
+            ),
+            hnsw_config=HnswConfigDiff(
+                m=HNSW_M,
+                ef_construct=HNSW_EF_CONSTRUCT,
+                on_disk=True
+            ),
+            on_disk_payload=True,
+            quantization_config=QUANTIZATION_CONFIG
         )
         
         logger.info(
             f"✅ Created collection '{collection_name}' "
-            f"(dim={dimension}, distance={distance.value})"
+            f"(dim={dimension}, distance={distance.value}, quantization=int8)"
         )
+        _ensured.add(collection_name)
         return True
         
     except Exception as e:
@@ -113,21 +175,54 @@ def ensure_collection(
 
 
 # Singleton instance
-_qdrant_client = None
+_async_qdrant_client = None
+_qdrant_lock = threading.Lock()
 
 
-def get_qdrant() -> QdrantClient | None:
+def get_qdrant() -> AsyncQdrantClient | None:
     """
-    Get singleton Qdrant client instance.
+    Get singleton async Qdrant client instance.
     Initializes on first call, returns cached instance thereafter.
+    
+    Note:
+        The default collection is ensured once by init_qdrant() on startup.
     """
-    global _qdrant_client
+    global _async_qdrant_client
     
-    if _qdrant_client is None:
-        _qdrant_client = get_qdrant_client()
-        
-        # Ensure default collection exists
-        if _qdrant_client:
-            ensure_collection(_qdrant_client)
+    # Double-checked locking: concurrent first calls build only one client
+    if _async_qdrant_client is None:
+        with _qdrant_lock:
+            if _async_qdrant_client is None:
+                _async_qdrant_client = get_qdrant_client()
+    
+    return _async_qdrant_client
+
+
+async def init_qdrant() -> AsyncQdrantClient | None:
+    """
+    Build the singleton client and ensure the default collection exists.
+    Called from the FastAPI startup hook so the first request doesn't pay init cost.
+    """
+    client = get_qdrant()
+    
+    if client:
+        await ensure_collection(client)
+    
+    return client
+
+
+async def close_qdrant() -> None:
+    """
+    Close the singleton Qdrant client and drain its connection pool.
+    Called from the FastAPI shutdown hook.
+    """
+    global _async_qdrant_client
     
-    return _qdrant_client
\ No newline at end of file
+    if _async_qdrant_client is not None:
+        try:
+            await _async_qdrant_client.close()
+            logger.info("✅ Qdrant client closed")
+        except Exception as e:
+            logger.error(f"❌ Failed to close Qdrant client: {e}")
+        finally:
+            _async_qdrant_client = None
\ No newline at end of file
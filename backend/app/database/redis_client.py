@@ -0,0 +1,56 @@
+# backend/app/database/redis_client.py
+"""
+Redis client for state shared across workers (CSV and image chat sessions).
+Optional: without REDIS_URL, callers keep state in-process only.
+"""
+import os
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Environment variables
+REDIS_URL = os.getenv("REDIS_URL", "")
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "50"))
+
+# Singleton instance
+_redis_client = None
+
+
+def get_redis():
+    """
+    Get singleton async Redis client instance.
+    The client connects lazily, so creating it does not block.
+    
+    Returns:
+        redis.asyncio.Redis instance or None if not configured
+    """
+    global _redis_client
+    
+    if _redis_client is not None or not REDIS_URL:
+        return _redis_client
+    
+    try:
+        import redis.asyncio as redis
+        
+        _redis_client = redis.from_url(
+            REDIS_URL,
+            max_connections=REDIS_POOL_SIZE,
+            socket_timeout=5.0
+        )
+        logger.info("✅ Redis client initialized")
+    except Exception as e:
+        logger.error(f"❌ Failed to initialize Redis client: {e}")
+        return None
+    
+    return _redis_client
+
+
+async def close_redis() -> None:
+    """Close the client's connection pool."""
+    global _redis_client
+    
+    if _redis_client is not None:
+        await _redis_client.aclose()
+    _redis_client = None
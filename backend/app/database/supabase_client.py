@@ -6,8 +6,16 @@ Uses SERVICE_ROLE_KEY for full access to database and storage.
 SECURITY: This client should NEVER be exposed to the frontend.
 """
 import os
-from supabase import create_client, Client
+import asyncio
+import threading
+from supabase import (
+    create_client, Client, ClientOptions,
+    acreate_client, AsyncClient, AsyncClientOptions
+)
+import httpx
+import orjson
 import logging
+from typing import Dict, List
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +24,15 @@ logger = logging.getLogger(__name__)
 # Environment variables
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "100"))
+
+
+def _create_pool_limits() -> httpx.Limits:
+    """Connection pool limits shared by both clients."""
+    return httpx.Limits(
+        max_connections=SUPABASE_POOL_SIZE,
+        max_keepalive_connections=SUPABASE_POOL_SIZE // 2
+    )
 
 
 def get_supabase_client() -> Client | None:
@@ -29,6 +46,9 @@ def get_supabase_client() -> Client | None:
         - Uses SERVICE_ROLE_KEY (bypasses RLS for admin operations)
         - Should only be used in backend, never exposed to frontend
         - All user-scoped operations must filter by user_id explicitly
+        
+    Performance:
+        - All sub-clients share one pooled httpx session (SUPABASE_POOL_SIZE)
     """
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
         logger.warning(
@@ -38,7 +58,17 @@ def get_supabase_client() -> Client | None:
         return None
     
     try:
-        client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        # Shared pooled HTTP/2 session for PostgREST, Storage and Functions
+        http_client = httpx.Client(
+            http2=True,
+            timeout=30.0,
+            limits=_create_pool_limits()
+        )
+        client = create_client(
+            SUPABASE_URL,
+            SUPABASE_SERVICE_ROLE_KEY,
+            options=ClientOptions(httpx_client=http_client)
+        )
         logger.info("✅ Supabase client initialized (server-side)")
         return client
     except Exception as e:
@@ -48,6 +78,7 @@ def get_supabase_client() -> Client | None:
 
 # Singleton instance
 _supabase_client = None
+_supabase_lock = threading.Lock()
 
 
 def get_supabase() -> Client | None:
@@ -57,7 +88,96 @@ def get_supabase() -> Client | None:
     """
     global _supabase_client
     
+    # Double-checked locking: concurrent first calls build only one client
     if _supabase_client is None:
-        _supabase_client = get_supabase_client()
+        with _supabase_lock:
+            if _supabase_client is None:
+                _supabase_client = get_supabase_client()
+    
+    return _supabase_client
+
+
+# ============================================
+# ASYNC CLIENT (hot paths: message reads/writes)
+# ============================================
+
+_async_supabase_client = None
+_async_http_client = None
+_async_supabase_lock = asyncio.Lock()
+
+
+async def get_async_supabase() -> AsyncClient | None:
+    """
+    Get singleton async Supabase client instance.
+    PostgREST calls are awaited on the event loop instead of blocking it,
+    and multiplexed over one pooled HTTP/2 session.
+    
+    Returns:
+        Async Supabase client or None if not configured
+    """
+    global _async_supabase_client, _async_http_client
+    
+    if _async_supabase_client is not None:
+        return _async_supabase_client
+    
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        return None
+    
+    async with _async_supabase_lock:
+        if _async_supabase_client is None:
+            try:
+                _async_http_client = httpx.AsyncClient(
+                    http2=True,
+                    timeout=30.0,
+                    limits=_create_pool_limits()
+                )
+                _async_supabase_client = await acreate_client(
+                    SUPABASE_URL,
+                    SUPABASE_SERVICE_ROLE_KEY,
+                    options=AsyncClientOptions(httpx_client=_async_http_client)
+                )
+                logger.info("✅ Async Supabase client initialized (server-side)")
+            except Exception as e:
+                logger.error(f"❌ Failed to initialize async Supabase client: {e}")
+                return None
+    
+    return _async_supabase_client
+
+
+async def close_async_supabase() -> None:
+    """Close the async client's connection pool."""
+    global _async_supabase_client, _async_http_client
+    
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+    _async_supabase_client = None
+    _async_http_client = None
+
+
+async def insert_rows(table: str, rows: List[Dict]) -> None:
+    """
+    Bulk-insert rows through PostgREST with an orjson-encoded body.
+    Skips supabase-py's stdlib json encoding on the hot message-write path.
+    
+    Args:
+        table: Table name in the public schema
+        rows: Rows to insert (one statement, no rows returned)
+        
+    Raises:
+        RuntimeError: If Supabase is not configured
+        httpx.HTTPStatusError: If PostgREST rejects the insert
+    """
+    if await get_async_supabase() is None:
+        raise RuntimeError("Supabase not configured")
     
-    return _supabase_client
\ No newline at end of file
+    response = await _async_http_client.post(
+        f"{SUPABASE_URL}/rest/v1/{table}",
+        content=orjson.dumps(rows),
+        headers={
+            "apikey": SUPABASE_SERVICE_ROLE_KEY,
+            "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal"
+        }
+    )
+    response.raise_for_status()
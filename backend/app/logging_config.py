@@ -0,0 +1,12 @@
+# backend/app/logging_config.py
+"""
+Process-wide logging setup.
+Imported first by app.main, so messages that app modules emit at import
+go through a single configured handler.
+"""
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
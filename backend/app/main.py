@@ -1,21 +1,34 @@
+from app import logging_config  # noqa: F401  (configures logging; must stay first)
+import asyncio
+import logging
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import auth, chat, image, csv, history  # Add history
-import logging
-
-from app.routers import auth, chat, image, csv
+from fastapi.responses import ORJSONResponse
+from app.routers import auth, chat, image, csv, history
+from app.database.qdrant_client import init_qdrant, close_qdrant
+from app.database.supabase_client import get_async_supabase, close_async_supabase
+from app.database.redis_client import close_redis
+from app.database.qdrant_batcher import get_search_batcher
+from app.services.rag_service import get_embedding_model
+from app.services.embedding_batcher import get_embedding_batcher
+from app.services.chat_service import drain_pending_writes
+from app.utils.compression import SelectiveGZipMiddleware
+from app.utils.http import create_http_client
+from app.utils.jwt_verify import preload_jwks, close_jwks_client
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
+# Load the embedding model at import so `gunicorn --preload` shares its
+# weights copy-on-write across forked workers (enabled by gunicorn.conf.py)
+if os.getenv("PRELOAD_MODEL", "0") == "1":
+    get_embedding_model()
+
 app = FastAPI(
     title="Multi-Modal Chat Assistant API",
     description="Backend for text, image, and CSV-based conversational AI",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse  # orjson: faster encoding of large replies
 )
 
 # CORS middleware
@@ -25,8 +38,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Conversation-Id"],  # Read by clients of /chat/stream
 )
 
+# Compress JSON replies (chat history, CSV summaries) above 1 KB;
+# SSE streams and images are passed through uncompressed
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Include routers
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(chat.router, prefix="/chat", tags=["chat"])
@@ -35,6 +53,37 @@ app.include_router(csv.router, prefix="/csv", tags=["csv"])
 app.include_router(history.router, prefix="/history", tags=["history"]) 
 
 
+@app.on_event("startup")
+async def startup():
+    """Create shared clients and warm Qdrant, Supabase, JWKS and the embedding model concurrently"""
+    app.state.http = create_http_client()
+    
+    results = await asyncio.gather(
+        init_qdrant(),
+        get_async_supabase(),
+        preload_jwks(),
+        asyncio.to_thread(get_embedding_model),
+        return_exceptions=True
+    )
+    
+    for name, result in zip(["Qdrant", "Supabase", "JWKS", "Embedding model"], results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ {name} warmup failed: {result}")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush background writes, then release pooled client connections"""
+    await drain_pending_writes()
+    await app.state.http.aclose()
+    await close_async_supabase()
+    await close_redis()
+    await close_jwks_client()
+    await get_embedding_batcher().close()
+    await get_search_batcher().close()
+    await close_qdrant()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
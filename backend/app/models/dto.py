@@ -2,9 +2,15 @@
 """
 Data Transfer Objects (DTOs) for API requests and responses.
 """
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, TypeAdapter, field_serializer, field_validator
 from typing import Optional, List, Dict
-from datetime import datetime
+from datetime import datetime, timezone
+import time
+
+
+def _ns_to_iso(ts_ns: int) -> str:
+    """Format a time.time_ns() timestamp as ISO 8601 (UTC)."""
+    return datetime.fromtimestamp(ts_ns / 1e9, tz=timezone.utc).isoformat()
 
 
 # ============================================
@@ -39,14 +45,22 @@ class ImageReply(BaseModel):
 
 class CsvInUrl(BaseModel):
     """CSV analysis request via URL"""
-    csvUrl: HttpUrl = Field(..., description="URL of the CSV file")
+    csvUrl: str = Field(..., max_length=2048, description="URL of the CSV file (http/https)")
     prompt: str = Field(..., min_length=1, max_length=1000, description="Analysis request")
+    
+    @field_validator("csvUrl")
+    @classmethod
+    def _validate_csv_url(cls, v: str) -> str:
+        # Cheap scheme guard; httpx performs full URL parsing when fetching
+        if not v.startswith(("http://", "https://")):
+            raise ValueError("csvUrl must start with http:// or https://")
+        return v
 
 
 class CsvReply(BaseModel):
     """CSV analysis response"""
     summary: str = Field(..., description="Analysis summary or insights")
-    plot_base64: Optional[str] = Field(None, description="Base64-encoded plot (PNG)")
+    plot_url: Optional[str] = Field(None, description="URL of the rendered plot (WebP)")
 
 
 # ============================================
@@ -57,8 +71,12 @@ class CsvChatMessage(BaseModel):
     """Single message in CSV conversation"""
     role: str = Field(..., description="Message role: 'user' or 'assistant'")
     content: str = Field(..., description="Message content")
-    plot_base64: Optional[str] = Field(None, description="Base64-encoded plot if included")
-    timestamp: datetime = Field(default_factory=datetime.now, description="Message timestamp")
+    plot_url: Optional[str] = Field(None, description="URL of the plot (WebP) if included")
+    timestamp: int = Field(default_factory=time.time_ns, description="Message timestamp (ns since epoch)")
+    
+    @field_serializer("timestamp")
+    def _serialize_timestamp(self, ts_ns: int) -> str:
+        return _ns_to_iso(ts_ns)
 
 
 class CsvUploadResponse(BaseModel):
@@ -78,7 +96,7 @@ class CsvChatReply(BaseModel):
     """AI response in CSV conversation"""
     session_id: str = Field(..., description="Session ID")
     reply: str = Field(..., description="AI-generated response")
-    plot_base64: Optional[str] = Field(None, description="Base64-encoded plot if generated")
+    plot_url: Optional[str] = Field(None, description="URL of the plot (WebP) if generated")
     conversation_history: List[CsvChatMessage] = Field(..., description="Full conversation history")
 
 
@@ -90,7 +108,11 @@ class ImageChatMessage(BaseModel):
     """Single message in image chat conversation"""
     role: str = Field(..., description="Message role: 'user' or 'assistant'")
     content: str = Field(..., description="Message content")
-    timestamp: str = Field(..., description="Message timestamp (ISO format)")
+    timestamp: int = Field(default_factory=time.time_ns, description="Message timestamp (ns since epoch)")
+    
+    @field_serializer("timestamp")
+    def _serialize_timestamp(self, ts_ns: int) -> str:
+        return _ns_to_iso(ts_ns)
 
 
 class ImageChatUploadResponse(BaseModel):
@@ -122,6 +144,22 @@ class ImageSessionInfo(BaseModel):
     created_at: str = Field(..., description="Session creation timestamp")
 
 
+# ============================================
+# MODEL PRECOMPILATION
+# ============================================
+# Make sure every schema is complete at import so the first request never rebuilds it
+
+for _model in (
+    ChatRequest, ChatReply, ImageReply,
+    CsvInUrl, CsvReply, CsvChatMessage, CsvUploadResponse, CsvChatRequest, CsvChatReply,
+    ImageChatMessage, ImageChatUploadResponse, ImageChatRequest, ImageChatReply, ImageSessionInfo,
+):
+    _model.model_rebuild()
+
+# Reusable serializer for CSV conversation history
+CSV_HISTORY_ADAPTER = TypeAdapter(List[CsvChatMessage])
+
+
 # ============================================
 # DATABASE HOOKS (For Future Implementation)
 # ============================================
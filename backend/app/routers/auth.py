@@ -13,7 +13,7 @@ async def get_current_user(request: Request):
     TODO: Replace with real JWT verification (Supabase/Firebase JWKS)
     """
     try:
-        user_info = verify_bearer_or_401(request)
+        user_info = await verify_bearer_or_401(request)
         return {
             "user_id": user_info["user_id"],
             "email": "demo@example.com",
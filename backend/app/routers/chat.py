@@ -3,11 +3,13 @@
 Chat router - Multi-turn text conversation.
 """
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.models.dto import ChatRequest, ChatReply
 from app.services.chat_service import generate_chat_response, load_conversation_from_db
 from app.utils.jwt_verify import get_current_user
 from datetime import datetime
 import logging
+import orjson
 import uuid
 
 router = APIRouter()
@@ -51,18 +53,62 @@ async def chat_endpoint(
         raise HTTPException(status_code=500, detail=f"Chat processing failed: {str(e)}")
 
 
+@router.post("/stream")
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Text chat with the reply streamed as Server-Sent Events.
+    Each event carries a JSON-encoded text chunk; a final "done" event closes the stream.
+    The conversation ID is returned in the X-Conversation-Id header.
+    Requires authentication.
+    """
+    conversation_id = request.conversation_id
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+        logger.info(f"Created new conversation: {conversation_id}")
+    
+    chunks = await generate_chat_response(
+        request.message,
+        conversation_history=None,  # Service loads from DB
+        user_id=user_id,
+        conversation_id=conversation_id,
+        save_to_db=True,
+        stream=True
+    )
+    
+    async def event_stream():
+        async for chunk in chunks:
+            yield f"data: {orjson.dumps(chunk).decode()}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "X-Conversation-Id": conversation_id,
+            "Cache-Control": "no-cache"
+        }
+    )
+
+
 @router.get("/history/{conversation_id}")
 async def get_chat_history(
     conversation_id: str,
     user_id: str = Depends(get_current_user)
 ):
     """
-    Get all messages in a conversation from database.
+    Get the messages in a conversation from database
+    (the newest CONVERSATION_LOAD_LIMIT, 200 by default).
     Requires authentication.
     """
     try:
-        # Load conversation from database
+        # Read the table directly: the in-process cache is per worker and can
+        # miss turns written by another worker
         messages = await load_conversation_from_db(user_id, conversation_id)
+        if messages is None:
+            raise RuntimeError("database query failed")
         
         return {
             "conversation_id": conversation_id,
@@ -3,23 +3,68 @@
 CSV router - Upload CSV or provide URL for data analysis with AI chatbot capabilities.
 """
 from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
 from app.models.dto import (
     CsvInUrl, CsvReply, 
-    CsvUploadResponse, CsvChatRequest, CsvChatReply
+    CsvUploadResponse, CsvChatRequest, CsvChatReply,
+    CSV_HISTORY_ADAPTER
 )
 from app.services.csv_service import (
     analyze_csv,
     create_csv_session,
     chat_with_csv,
-    get_session_info
+    stream_chat_with_csv,
+    get_session_info,
+    get_plot,
+    PLOT_CACHE_TTL,
+    PLOT_MEDIA_TYPE
 )
 from app.utils.jwt_verify import get_current_user
+from app.utils.http import get_http_client, fetch_csv
+import gc
+import hashlib
 import logging
+import orjson
+import tempfile
 import httpx
+from cachetools import TTLCache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Accepted upload extensions (tuple form for a single endswith call)
+_CSV_EXTS = (".csv",)
+
+# Streaming ingestion: small CSVs stay in memory, larger ones spill to disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Messages returned per /chat/message reply unless ?full=true
+RECENT_HISTORY_LIMIT = 20
+
+# Single-shot URL analyses, keyed by sha256(url + prompt).
+# Only touched from the event loop, so no lock is needed.
+url_analysis_cache = TTLCache(maxsize=256, ttl=300)
+
+
+def _is_csv_filename(filename: str | None) -> bool:
+    """Case-insensitive extension check against _CSV_EXTS."""
+    return bool(filename) and filename.lower().endswith(_CSV_EXTS)
+
+
+def _model_response(model: BaseModel) -> Response:
+    """
+    Serialize a reply DTO to JSON in one pydantic-core pass.
+    Skips FastAPI's dump → re-validate → encode round trip on response_model;
+    response_model is kept on the routes for the OpenAPI schema.
+    """
+    return Response(content=model.model_dump_json(), media_type="application/json")
+
+
+def _url_cache_key(user_id: str, url: str, prompt: str) -> str:
+    """Hash user, URL and prompt into a fixed-size cache key (results are per user)."""
+    return hashlib.sha256(f"{user_id}\0{url}\0{prompt}".encode("utf-8")).hexdigest()
+
 
 # ============================================
 # ORIGINAL ENDPOINTS (Backward Compatibility)
@@ -29,7 +74,8 @@ logger = logging.getLogger(__name__)
 @router.post("/url", response_model=CsvReply)
 async def analyze_csv_url(
     request: CsvInUrl,
-    user_id: str = Depends(get_current_user)
+    user_id: str = Depends(get_current_user),
+    http: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Analyze CSV from a URL (single-shot analysis).
@@ -38,39 +84,37 @@ async def analyze_csv_url(
     Requires authentication.
     Note: Use /chat endpoints for multi-turn conversations.
     """
+    cache_key = _url_cache_key(user_id, str(request.csvUrl), request.prompt)
+    cached = url_analysis_cache.get(cache_key)
+    if cached is not None:
+        logger.info("⚡ Cache hit for CSV URL: %s", request.csvUrl)
+        return _model_response(cached)
+    
     try:
-        logger.info(f"📊 Fetching CSV from URL: {request.csvUrl}")
+        logger.info("📊 Fetching CSV from URL: %s", request.csvUrl)
         
-        # Fetch CSV from URL
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(str(request.csvUrl))
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Failed to fetch CSV from URL: {response.status_code}"
-                )
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            # Stream CSV from URL into the spool (shared pooled client)
+            size = await fetch_csv(http, str(request.csvUrl), spool)
+            logger.info("✅ CSV fetched: %s bytes", size)
             
-            csv_content = response.text
+            # Analyze CSV (pandas decodes while parsing)
+            result = await analyze_csv(spool, request.prompt)
         
-        logger.info(f"✅ CSV fetched: {len(csv_content)} characters")
+        gc.collect()
         
-        # Analyze CSV
-        result = await analyze_csv(csv_content, request.prompt)
-        
-        return CsvReply(
+        reply = CsvReply(
             summary=result["summary"],
-            plot_base64=result.get("plot_base64")
+            plot_url=result.get("plot_url")
         )
+        if result.get("cacheable"):
+            url_analysis_cache[cache_key] = reply
+        return _model_response(reply)
         
-    except httpx.RequestError as e:
-        logger.error(f"❌ Error fetching CSV: {e}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Failed to fetch CSV: {str(e)}"
-        )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ CSV analysis error: {e}")
+        logger.error("❌ CSV analysis error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"CSV analysis failed: {str(e)}"
@@ -92,28 +136,26 @@ async def analyze_csv_file(
     """
     try:
         # Check file extension
-        if not file.filename.endswith('.csv'):
+        if not _is_csv_filename(file.filename):
             raise HTTPException(
                 status_code=400,
                 detail="File must be a CSV file (.csv extension)"
             )
         
-        logger.info(f"📊 Processing CSV file: {file.filename}")
-        
-        # Read CSV content
-        content = await file.read()
-        csv_content = content.decode('utf-8')
+        logger.info("📊 Processing CSV file: %s", file.filename)
         
-        logger.info(f"✅ CSV loaded: {len(csv_content)} characters")
+        # UploadFile.file is already a spooled temp file: parse it in place
+        result = await analyze_csv(file.file, prompt)
         
-        # Analyze CSV
-        result = await analyze_csv(csv_content, prompt)
+        gc.collect()
         
-        return CsvReply(
+        return _model_response(CsvReply(
             summary=result["summary"],
-            plot_base64=result.get("plot_base64")
-        )
+            plot_url=result.get("plot_url")
+        ))
         
+    except HTTPException:
+        raise
     except UnicodeDecodeError:
         logger.error("❌ Invalid CSV encoding")
         raise HTTPException(
@@ -121,7 +163,7 @@ async def analyze_csv_file(
             detail="Invalid CSV file encoding. Please ensure the file is UTF-8 encoded."
         )
     except Exception as e:
-        logger.error(f"❌ CSV analysis error: {e}")
+        logger.error("❌ CSV analysis error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"CSV analysis failed: {str(e)}"
@@ -135,7 +177,8 @@ async def analyze_csv_file(
 @router.post("/chat/upload-url", response_model=CsvUploadResponse)
 async def upload_csv_url_for_chat(
     request: CsvInUrl,
-    user_id: str = Depends(get_current_user)
+    user_id: str = Depends(get_current_user),
+    http: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     Upload CSV from URL and start a new chat session.
@@ -151,42 +194,36 @@ async def upload_csv_url_for_chat(
     }
     """
     try:
-        logger.info(f"🆕 Creating chat session from URL: {request.csvUrl}")
+        logger.info("🆕 Creating chat session from URL: %s", request.csvUrl)
         
-        # Fetch CSV from URL
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(str(request.csvUrl))
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            # Fetch CSV from URL (shared pooled client)
+            await fetch_csv(http, str(request.csvUrl), spool)
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Failed to fetch CSV from URL: {response.status_code}"
-                )
-            
-            csv_content = response.text
-        
-        # Create chat session
-        session_data = await create_csv_session(
-            csv_content=csv_content,
-            source_type="url",
-            source_value=str(request.csvUrl),
-            initial_message=request.prompt
-        )
+            # Create chat session (pandas decodes while parsing)
+            session_data = await create_csv_session(
+                source=spool,
+                source_type="url",
+                source_value=str(request.csvUrl),
+                initial_message=request.prompt
+            )
         
-        return CsvUploadResponse(
+        return _model_response(CsvUploadResponse(
             session_id=session_data["session_id"],
             message=session_data["message"],
             csv_info=session_data["csv_info"]
-        )
+        ))
         
-    except httpx.RequestError as e:
-        logger.error(f"❌ Error fetching CSV: {e}")
+    except HTTPException:
+        raise
+    except UnicodeDecodeError:
+        logger.error("❌ Invalid CSV encoding")
         raise HTTPException(
             status_code=400,
-            detail=f"Failed to fetch CSV: {str(e)}"
+            detail="Invalid CSV file encoding. Please ensure the file is UTF-8 encoded."
         )
     except Exception as e:
-        logger.error(f"❌ Session creation error: {e}")
+        logger.error("❌ Session creation error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create session: {str(e)}"
@@ -210,32 +247,30 @@ async def upload_csv_file_for_chat(
     """
     try:
         # Check file extension
-        if not file.filename.endswith('.csv'):
+        if not _is_csv_filename(file.filename):
             raise HTTPException(
                 status_code=400,
                 detail="File must be a CSV file (.csv extension)"
             )
         
-        logger.info(f"🆕 Creating chat session from file: {file.filename}")
+        logger.info("🆕 Creating chat session from file: %s", file.filename)
         
-        # Read CSV content
-        content = await file.read()
-        csv_content = content.decode('utf-8')
-        
-        # Create chat session
+        # UploadFile.file is already a spooled temp file: parse it in place
         session_data = await create_csv_session(
-            csv_content=csv_content,
+            source=file.file,
             source_type="file",
             source_value=file.filename,
             initial_message="I've uploaded a CSV file. Please give me an overview."
         )
         
-        return CsvUploadResponse(
+        return _model_response(CsvUploadResponse(
             session_id=session_data["session_id"],
             message=session_data["message"],
             csv_info=session_data["csv_info"]
-        )
+        ))
         
+    except HTTPException:
+        raise
     except UnicodeDecodeError:
         logger.error("❌ Invalid CSV encoding")
         raise HTTPException(
@@ -243,7 +278,7 @@ async def upload_csv_file_for_chat(
             detail="Invalid CSV file encoding. Please ensure the file is UTF-8 encoded."
         )
     except Exception as e:
-        logger.error(f"❌ Session creation error: {e}")
+        logger.error("❌ Session creation error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create session: {str(e)}"
@@ -253,6 +288,7 @@ async def upload_csv_file_for_chat(
 @router.post("/chat/message", response_model=CsvChatReply)
 async def send_chat_message(
     request: CsvChatRequest,
+    full: bool = False,
     user_id: str = Depends(get_current_user)
 ):
     """
@@ -260,6 +296,7 @@ async def send_chat_message(
     AI will respond based on conversation history and CSV data.
     
     Requires authentication.
+    The reply carries the last 20 messages; pass ?full=true for the whole history.
     
     Example:
     POST /csv/chat/message
@@ -269,36 +306,72 @@ async def send_chat_message(
     }
     """
     try:
-        logger.info(f"💬 Chat message for session: {request.session_id}")
+        logger.info("💬 Chat message for session: %s", request.session_id)
         
         # Process chat message
         result = await chat_with_csv(
             session_id=request.session_id,
-            user_message=request.message
+            user_message=request.message,
+            history_limit=None if full else RECENT_HISTORY_LIMIT
         )
         
-        return CsvChatReply(
+        return _model_response(CsvChatReply(
             session_id=result["session_id"],
             reply=result["reply"],
-            plot_base64=result.get("plot_base64"),
+            plot_url=result.get("plot_url"),
             conversation_history=result["conversation_history"]
-        )
+        ))
         
     except ValueError as e:
         # Session not found
-        logger.error(f"❌ Invalid session: {e}")
+        logger.error("❌ Invalid session: %s", e)
         raise HTTPException(
             status_code=404,
             detail=str(e)
         )
     except Exception as e:
-        logger.error(f"❌ Chat error: {e}")
+        logger.error("❌ Chat error: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Chat failed: {str(e)}"
         )
 
 
+@router.post("/chat/stream")
+async def stream_chat_message(
+    request: CsvChatRequest,
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Send a message in an ongoing CSV chat session, streaming the reply as Server-Sent Events.
+    Plot requests first get a "plot" event with the plot URL; text chunks follow as
+    JSON-encoded data events, and a final "done" event closes the stream.
+    
+    Requires authentication.
+    """
+    try:
+        events = await stream_chat_with_csv(request.session_id, request.message)
+    except ValueError as e:
+        logger.error("❌ Invalid session: %s", e)
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    async def event_stream():
+        async for event in events:
+            if "plot_url" in event:
+                yield f"event: plot\ndata: {orjson.dumps(event).decode()}\n\n"
+            else:
+                yield f"data: {orjson.dumps(event['text']).decode()}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache"
+        }
+    )
+
+
 @router.get("/chat/session/{session_id}")
 async def get_chat_session(
     session_id: str,
@@ -311,7 +384,7 @@ async def get_chat_session(
     Requires authentication.
     """
     try:
-        session_info = get_session_info(session_id)
+        session_info = await get_session_info(session_id)
         
         if not session_info:
             raise HTTPException(
@@ -319,18 +392,48 @@ async def get_chat_session(
                 detail=f"Session not found: {session_id}"
             )
         
-        return session_info
+        # Serialize the whole history in one pass with the cached adapter
+        session_info["conversation_history"] = CSV_HISTORY_ADAPTER.dump_python(
+            session_info["conversation_history"], mode="json"
+        )
+        
+        # Already JSON-ready: hand straight to orjson, skipping jsonable_encoder
+        return ORJSONResponse(session_info)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error fetching session: {e}")
+        logger.error("❌ Error fetching session: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to fetch session: {str(e)}"
         )
 
 
+@router.get("/plot/{plot_id}")
+async def get_plot_image(plot_id: str):
+    """
+    Serve a rendered plot image (lossless WebP).
+    
+    Plot IDs are random and expire, so the URL works like a short-lived
+    signed link and can be used directly as an <img> src.
+    """
+    image_bytes = await get_plot(plot_id)
+    
+    if image_bytes is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Plot not found or expired"
+        )
+    
+    # Plot IDs are never reused, so browsers may cache the image until it expires
+    return Response(
+        content=image_bytes,
+        media_type=PLOT_MEDIA_TYPE,
+        headers={"Cache-Control": f"private, max-age={PLOT_CACHE_TTL}, immutable"}
+    )
+
+
 # ============================================
 # DATABASE MIGRATION NOTES
 # ============================================
@@ -351,5 +454,5 @@ async def get_chat_session(
 #    - Filter sessions by user_id
 #
 # 4. Add cleanup/expiration:
-#    - Delete old sessions after 24 hours
+#    - Delete old sessions after 24 hours (in-memory sessions already expire via TTLCache)
 #    - Archive completed conversations
\ No newline at end of file
@@ -3,6 +3,7 @@
 Image chat router - Upload image and have conversations about it.
 """
 from fastapi import APIRouter, HTTPException, File, UploadFile, Form, Depends
+from fastapi.responses import StreamingResponse
 from app.models.dto import (
     ImageChatUploadResponse, 
     ImageChatRequest, 
@@ -12,11 +13,13 @@ from app.models.dto import (
 from app.services.image_service import (
     create_image_chat_session,
     chat_with_image,
+    stream_chat_with_image,
     get_session_info,
     delete_session
 )
 from app.utils.jwt_verify import get_current_user
 import logging
+import orjson
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -112,6 +115,36 @@ async def chat(
         )
 
 
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ImageChatRequest,
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Send a message about the uploaded image, streaming the reply as Server-Sent Events.
+    Each event carries a JSON-encoded text chunk; a final "done" event closes the stream.
+    
+    Requires authentication.
+    """
+    try:
+        chunks = await stream_chat_with_image(request.session_id, request.message)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    async def event_stream():
+        async for chunk in chunks:
+            yield f"data: {orjson.dumps(chunk).decode()}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache"
+        }
+    )
+
+
 @router.get("/session/{session_id}", response_model=ImageSessionInfo)
 async def get_session(
     session_id: str,
@@ -4,11 +4,16 @@ Chat service - Google Gemini API (NEW SDK)
 """
 from google import genai
 import os
+import asyncio
 import logging
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
 from dotenv import load_dotenv
-from datetime import datetime
-from app.database.supabase_client import get_supabase
+from datetime import datetime, timezone
+from cachetools import LRUCache
+from app.database.supabase_client import get_async_supabase, insert_rows
+from app.utils.context_window import recent_within_budget
+from app.services.response_cache import get_response_cache
+from app.utils.rate_limit import gemini_limiter, with_retry
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -24,6 +29,57 @@ else:
     client = None
     logger.warning("⚠️ GOOGLE_API_KEY not configured")
 
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Transcript line prefixes, by message role
+ROLE_PREFIXES = {"user": "User: ", "assistant": "Assistant: "}
+
+# Approximate token budget for history included in the Gemini prompt
+HISTORY_TOKEN_BUDGET = 6000
+
+# Older messages that fall outside the budget are kept as a running summary,
+# refreshed once this many new messages have dropped out of the window
+SUMMARY_REFRESH_MESSAGES = 6
+
+# In-process conversation cache: (user_id, conversation_id) -> messages.
+# Only touched from the event loop, so no thread lock is needed.
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1024"))
+_conversation_cache = LRUCache(maxsize=CONVERSATION_CACHE_SIZE)
+_load_locks = LRUCache(maxsize=CONVERSATION_CACHE_SIZE)  # One DB load per key at a time
+
+# Newest messages loaded per conversation; older ones stay in the table only
+CONVERSATION_LOAD_LIMIT = int(os.getenv("CONVERSATION_LOAD_LIMIT", "200"))
+
+# Running summaries: (user_id, conversation_id) -> (created_at of last summarized message, summary).
+# Keyed by time rather than list position, so it survives reloads that return
+# a different window of the conversation (see CONVERSATION_LOAD_LIMIT).
+_summaries = LRUCache(maxsize=CONVERSATION_CACHE_SIZE)
+_summary_tasks: Dict[Tuple[str, str], asyncio.Task] = {}  # Background refreshes in flight
+
+# Background message writes still in flight
+_pending_writes: set[asyncio.Task] = set()
+
+
+def _utc_now() -> str:
+    """Current UTC time as an ISO-8601 string (timezone-aware, unlike utcnow())."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _message_time(msg: Dict) -> Optional[datetime]:
+    """Parse a message's ISO-8601 timestamp (naive values are taken as UTC)."""
+    try:
+        ts = datetime.fromisoformat(msg["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _cache_message(cache_key: Tuple[str, str], message: Dict) -> None:
+    """Append a persisted message to a cached conversation (if it is cached)."""
+    messages = _conversation_cache.get(cache_key)
+    if messages is not None:
+        messages.append(message)
+
 
 async def save_message_to_db(
     user_id: str,
@@ -45,74 +101,178 @@ async def save_message_to_db(
     Returns:
         True if saved successfully, False otherwise
     """
-    supabase = get_supabase()
+    return await save_messages_batch(
+        user_id,
+        conversation_id,
+        [{"role": role, "content": content, "meta": meta}]
+    )
+
+
+async def save_messages_batch(
+    user_id: str,
+    conversation_id: str,
+    messages: List[Dict]
+) -> bool:
+    """
+    Save several messages to Supabase public.messages in one insert.
+    
+    Args:
+        user_id: User ID (from JWT)
+        conversation_id: Conversation UUID
+        messages: Dicts with role, content, and optional meta / created_at
+            (created_at defaults to now), in chronological order
+        
+    Returns:
+        True if saved successfully, False otherwise
+    """
+    supabase = await get_async_supabase()
     
     if not supabase:
-        logger.warning("⚠️ Supabase not configured - message not persisted")
+        logger.warning("⚠️ Supabase not configured - messages not persisted")
         return False
     
     try:
-        data = {
-            "user_id": user_id,
-            "conversation_id": conversation_id,
-            "role": role,
-            "content": content,
-            "meta": meta,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        
-        result = supabase.table("messages").insert(data).execute()
-        
-        logger.info(f"💾 Saved {role} message to DB (conversation: {conversation_id[:8]}...)")
+        now = _utc_now()
+        # Columns shared by every row are built once and copied per message
+        base_row = {"user_id": user_id, "conversation_id": conversation_id}
+        rows = [
+            {
+                **base_row,
+                "role": msg["role"],
+                "content": msg["content"],
+                "meta": msg.get("meta"),
+                "created_at": msg.get("created_at") or now
+            }
+            for msg in messages
+        ]
+        
+        # Update the cache first so a quick follow-up turn already sees these
+        # messages while the write is still in flight
+        for row in rows:
+            _cache_message(
+                (user_id, conversation_id),
+                {"role": row["role"], "content": row["content"], "timestamp": row["created_at"]}
+            )
+        
+        # One round-trip; PostgREST inserts the rows in a single statement
+        # and returns no body (nothing here reads the inserted rows back)
+        await insert_rows("messages", rows)
+        
+        logger.info(f"💾 Saved {len(rows)} message(s) to DB (conversation: {conversation_id[:8]}...)")
         return True
         
     except Exception as e:
-        logger.error(f"❌ Failed to save message to DB: {e}")
+        logger.error(f"❌ Failed to save messages to DB: {e}")
+        # Cached copy may no longer match the table; reload on next access
+        _conversation_cache.pop((user_id, conversation_id), None)
         return False
 
 
+def save_messages_in_background(
+    user_id: str,
+    conversation_id: str,
+    messages: List[Dict]
+) -> None:
+    """
+    Schedule save_messages_batch without waiting for it.
+    Failures are logged inside the task; drain_pending_writes() flushes on shutdown.
+    """
+    task = asyncio.create_task(save_messages_batch(user_id, conversation_id, messages))
+    _pending_writes.add(task)  # Keep a reference so the task isn't garbage-collected
+    task.add_done_callback(_pending_writes.discard)
+
+
+async def drain_pending_writes() -> None:
+    """Wait for in-flight background writes (called on shutdown)."""
+    if _pending_writes:
+        logger.info(f"⏳ Flushing {len(_pending_writes)} pending message write(s)...")
+        await asyncio.gather(*_pending_writes, return_exceptions=True)
+
+
 async def load_conversation_from_db(
     user_id: str,
     conversation_id: str
-) -> List[Dict]:
+) -> Optional[List[Dict]]:
     """
     Load conversation history from Supabase public.messages table.
+    Fetches only the newest CONVERSATION_LOAD_LIMIT messages; served by the
+    (user_id, conversation_id, created_at) index (see README). Running
+    summaries track coverage by created_at, so a reload that starts at a
+    different message does not shift what they consider already summarized.
     
     Args:
         user_id: User ID (from JWT)
         conversation_id: Conversation UUID
         
     Returns:
-        List of messages in chronological order
+        List of messages in chronological order, or None if the query failed
     """
-    supabase = get_supabase()
+    supabase = await get_async_supabase()
     
     if not supabase:
         logger.warning("⚠️ Supabase not configured - returning empty history")
         return []
     
     try:
-        result = supabase.table("messages")\
+        result = await supabase.table("messages")\
             .select("role, content, created_at")\
             .eq("user_id", user_id)\
             .eq("conversation_id", conversation_id)\
-            .order("created_at", desc=False)\
+            .order("created_at", desc=True)\
+            .limit(CONVERSATION_LOAD_LIMIT)\
             .execute()
         
-        messages = []
-        for row in result.data:
-            messages.append({
+        # Newest-first from the index; flip back to chronological order
+        messages = [
+            {
                 "role": row["role"],
                 "content": row["content"],
                 "timestamp": row["created_at"]
-            })
+            }
+            for row in reversed(result.data)
+        ]
         
         logger.info(f"📖 Loaded {len(messages)} messages from DB (conversation: {conversation_id[:8]}...)")
         return messages
         
     except Exception as e:
         logger.error(f"❌ Failed to load conversation from DB: {e}")
-        return []
+        return None
+
+
+async def get_conversation(user_id: str, conversation_id: str) -> List[Dict]:
+    """
+    Get conversation history, from the in-process cache when possible.
+    
+    Args:
+        user_id: User ID (from JWT)
+        conversation_id: Conversation UUID
+        
+    Returns:
+        Copy of the messages in chronological order
+    """
+    cache_key = (user_id, conversation_id)
+    
+    messages = _conversation_cache.get(cache_key)
+    if messages is not None:
+        return list(messages)
+    
+    lock = _load_locks.get(cache_key)
+    if lock is None:
+        lock = _load_locks[cache_key] = asyncio.Lock()
+    
+    async with lock:
+        # Another request may have loaded it while we waited
+        messages = _conversation_cache.get(cache_key)
+        if messages is None:
+            messages = await load_conversation_from_db(user_id, conversation_id)
+            if messages is None:
+                # Failed load: don't cache it, retry on the next access
+                return []
+            # Empty (new) conversations are cached too; saves append to them
+            _conversation_cache[cache_key] = messages
+    
+    return list(messages)
 
 
 async def generate_chat_response(
@@ -123,7 +283,7 @@ async def generate_chat_response(
     save_to_db: bool = True,
     stream: bool = False,
     gen_params: Optional[Dict] = None
-) -> str:
+) -> Union[str, AsyncIterator[str]]:
     """
     Generate AI response using Google Gemini (NEW SDK).
     
@@ -133,54 +293,67 @@ async def generate_chat_response(
         user_id: User ID for DB persistence (optional)
         conversation_id: Conversation ID for DB persistence (optional)
         save_to_db: Whether to persist messages to database
-        stream: Enable streaming (not implemented yet)
+        stream: Return an async iterator of text chunks instead of the full reply
         gen_params: Generation parameters (not used yet)
         
     Returns:
-        AI-generated response
+        AI-generated response (or an async iterator of chunks when stream=True)
     """
+    if stream:
+        return stream_chat_response(
+            message,
+            conversation_history=conversation_history,
+            user_id=user_id,
+            conversation_id=conversation_id,
+            save_to_db=save_to_db
+        )
+    
     if not client:
         return "⚠️ Google Gemini API key not configured. Please add GOOGLE_API_KEY to your .env file."
     
     try:
-        # If DB is enabled and user_id provided, try loading from DB first
+        # If DB is enabled and user_id provided, try loading from cache/DB first
         if save_to_db and user_id and conversation_id:
-            db_history = await load_conversation_from_db(user_id, conversation_id)
+            db_history = await get_conversation(user_id, conversation_id)
             if db_history:
                 conversation_history = db_history
         
-        # Save user message to DB
-        if save_to_db and user_id and conversation_id:
-            await save_message_to_db(
-                user_id=user_id,
-                conversation_id=conversation_id,
-                role="user",
-                content=message
-            )
-        
-        # Build conversation context
-        context = _build_context(conversation_history, message)
+        # User message is timestamped now, persisted with the reply below
+        user_created_at = _utc_now()
         
-        logger.info(f"🤖 Calling Gemini API...")
-        logger.info(f"📝 Context length: {len(context)} chars")
-        
-        # Generate response using NEW SDK
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=context
-        )
+        # Repeat of an earlier message in the same conversation and context: reuse its reply.
+        # Opening messages have no context to tell them apart, so they always go to the model.
+        response_cache = get_response_cache()
+        use_cache = bool(user_id and conversation_id and conversation_history)
+        context_key = response_cache.context_key(conversation_history) if use_cache else None
+        ai_response = None
+        if use_cache:
+            ai_response = response_cache.lookup(user_id, conversation_id, context_key, message)
         
-        ai_response = response.text.strip()
-        
-        logger.info(f"✅ Generated response: {len(ai_response)} chars")
+        if ai_response is None:
+            # Build conversation context
+            context = await _prepare_context(message, conversation_history, user_id, conversation_id)
+            
+            logger.info(f"🤖 Calling Gemini API...")
+            logger.info(f"📝 Context length: {len(context)} chars")
+            
+            # Generate response using NEW SDK (rate-limited, retried)
+            ai_response = await _generate(context)
+            
+            logger.info(f"✅ Generated response: {len(ai_response)} chars")
+            
+            if use_cache:
+                response_cache.store(user_id, conversation_id, context_key, message, ai_response)
         
-        # Save assistant response to DB
+        # Save both turns to DB in one insert, off the response path
         if save_to_db and user_id and conversation_id:
-            await save_message_to_db(
+            save_messages_in_background(
                 user_id=user_id,
                 conversation_id=conversation_id,
-                role="assistant",
-                content=ai_response
+                messages=[
+                    {"role": "user", "content": message, "created_at": user_created_at},
+                    {"role": "assistant", "content": ai_response}
+                ]
             )
         
         return ai_response
@@ -190,22 +363,192 @@ async def generate_chat_response(
         return _fallback_response(message, conversation_history)
 
 
-def _build_context(history: List[Dict], current_message: str) -> str:
-    """Build conversation context for Gemini."""
-    context_parts = ["You are a helpful AI assistant. Be concise and natural.\n"]
+async def stream_chat_response(
+    message: str,
+    conversation_history: List[Dict] = None,
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    save_to_db: bool = True
+) -> AsyncIterator[str]:
+    """
+    Stream an AI response from Gemini chunk by chunk.
+    The full reply is persisted once, after the stream completes.
     
-    # Add recent history
-    if history and len(history) > 0:
-        recent = history[-10:] if len(history) > 10 else history
+    Args:
+        message: User's message
+        conversation_history: In-memory history (fallback if DB disabled)
+        user_id: User ID for DB persistence (optional)
+        conversation_id: Conversation ID for DB persistence (optional)
+        save_to_db: Whether to persist messages to database
         
-        for msg in recent:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            
-            if role == "user":
-                context_parts.append(f"User: {content}")
-            elif role == "assistant":
-                context_parts.append(f"Assistant: {content}")
+    Yields:
+        Text chunks as Gemini produces them
+    """
+    if not client:
+        yield "⚠️ Google Gemini API key not configured. Please add GOOGLE_API_KEY to your .env file."
+        return
+    
+    if save_to_db and user_id and conversation_id:
+        db_history = await get_conversation(user_id, conversation_id)
+        if db_history:
+            conversation_history = db_history
+    
+    user_created_at = _utc_now()
+    context = await _prepare_context(message, conversation_history, user_id, conversation_id)
+    
+    logger.info(f"🤖 Streaming from Gemini API ({len(context)} chars context)...")
+    
+    chunks = []
+    try:
+        # Holds a limiter slot for the whole stream
+        async with gemini_limiter:
+            async for chunk in await client.aio.models.generate_content_stream(
+                model=GEMINI_MODEL,
+                contents=context
+            ):
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+    
+    except Exception as e:
+        logger.error(f"❌ Gemini stream error: {e}")
+        if not chunks:
+            yield _fallback_response(message, conversation_history)
+        return  # Incomplete replies are not persisted
+    
+    ai_response = "".join(chunks).strip()
+    logger.info(f"✅ Streamed response: {len(ai_response)} chars")
+    
+    if save_to_db and user_id and conversation_id:
+        save_messages_in_background(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            messages=[
+                {"role": "user", "content": message, "created_at": user_created_at},
+                {"role": "assistant", "content": ai_response}
+            ]
+        )
+
+
+async def _generate(contents: str) -> str:
+    """Call Gemini under the shared rate limiter, retrying transient errors."""
+    async def call():
+        async with gemini_limiter:
+            return await client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=contents
+            )
+    
+    response = await with_retry(call)
+    return response.text.strip()
+
+
+async def _prepare_context(
+    message: str,
+    history: Optional[List[Dict]],
+    user_id: Optional[str],
+    conversation_id: Optional[str]
+) -> str:
+    """
+    Build the Gemini prompt: running summary of older turns + recent turns verbatim.
+    
+    Args:
+        message: Current user message
+        history: Conversation history in chronological order
+        user_id: User ID (summaries are only kept for persisted conversations)
+        conversation_id: Conversation ID
+        
+    Returns:
+        Prompt text
+    """
+    history = history or []
+    recent = recent_within_budget(
+        history, HISTORY_TOKEN_BUDGET, lambda msg: msg.get("content", "")
+    )
+    older = history[:len(history) - len(recent)]
+    
+    summary = None
+    if older and user_id and conversation_id:
+        summary = await _get_summary((user_id, conversation_id), older)
+    
+    return _build_context(recent, message, summary)
+
+
+async def _get_summary(cache_key: Tuple[str, str], older: List[Dict]) -> Optional[str]:
+    """
+    Return a running summary of messages that no longer fit the prompt window.
+    Regenerated incrementally (previous summary + messages newer than the last
+    summarized one) once SUMMARY_REFRESH_MESSAGES more messages have dropped out.
+    Every refresh, including the first, runs in the background so a turn makes
+    a single Gemini call on its response path; until the first one lands the
+    prompt simply has no summary.
+    """
+    covered_until, summary = _summaries.get(cache_key, (None, None))
+    
+    new_messages = older
+    if covered_until is not None:
+        new_messages = [
+            msg for msg in older
+            if (_message_time(msg) or covered_until) > covered_until
+        ]
+    
+    due = len(new_messages) >= SUMMARY_REFRESH_MESSAGES if summary else bool(new_messages)
+    if due and cache_key not in _summary_tasks:
+        task = asyncio.create_task(_refresh_summary(cache_key, new_messages, summary))
+        _summary_tasks[cache_key] = task
+        task.add_done_callback(lambda _: _summary_tasks.pop(cache_key, None))
+    
+    return summary
+
+
+async def _refresh_summary(
+    cache_key: Tuple[str, str],
+    new_messages: List[Dict],
+    summary: Optional[str]
+) -> Optional[str]:
+    """Fold new_messages into the summary and store it with the last message's created_at."""
+    covered_until = _message_time(new_messages[-1])
+    # Bound the summarization prompt too (e.g. a long conversation after a restart)
+    new_messages = recent_within_budget(
+        new_messages, HISTORY_TOKEN_BUDGET, lambda msg: msg.get("content", "")
+    )
+    transcript = "\n".join(
+        ROLE_PREFIXES.get(msg.get("role"), "Assistant: ") + msg.get("content", "")
+        for msg in new_messages
+    )
+    prompt = (
+        "Summarize the following conversation in under 200 tokens, "
+        "preserving names, preferences, and open questions.\n\n"
+        + (f"Summary so far:\n{summary}\n\nNew messages:\n" if summary else "")
+        + transcript
+    )
+    
+    try:
+        summary = await _generate(prompt)
+        _summaries[cache_key] = (covered_until, summary)
+        logger.info(f"📝 Summarized {len(new_messages)} older messages (conversation: {cache_key[1][:8]}...)")
+    except Exception as e:
+        # Keep using the stale summary (if any) rather than failing the turn
+        logger.warning(f"⚠️ Summary generation failed: {e}")
+    
+    return summary
+
+
+def _build_context(
+    recent: List[Dict],
+    current_message: str,
+    summary: Optional[str] = None
+) -> str:
+    """Build conversation context for Gemini from budget-trimmed history."""
+    context_parts = ["You are a helpful AI assistant. Be concise and natural.\n"]
+    
+    if summary:
+        context_parts.append(f"Previously: {summary}\n")
+    
+    for msg in recent:
+        prefix = ROLE_PREFIXES.get(msg.get("role"))
+        if prefix:
+            context_parts.append(prefix + msg.get("content", ""))
     
     # Add current message
     context_parts.append(f"User: {current_message}")
@@ -1,24 +1,34 @@
 # backend/app/services/csv_service.py
 """
-CSV analysis service using pandas + Claude 3.5 Sonnet AI.
+CSV analysis service using pandas + Claude 3.5 Haiku AI.
 Clean, simple, relies on AI intelligence for flexibility.
 """
 import pandas as pd
+import numpy as np
 import io
+import re
+import csv
 import logging
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import base64
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import asyncio
+from collections import deque
+from itertools import islice
 from io import BytesIO
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Union, IO
 import anthropic
 import os
 from dotenv import load_dotenv
 import uuid
+import hashlib
+import threading
+from cachetools import LRUCache, TTLCache
+import orjson
 from datetime import datetime
 from app.models.dto import CsvChatMessage
+from app.database.redis_client import get_redis
+from app.utils.context_window import recent_within_budget
+from app.utils.rate_limit import anthropic_limiter, with_retry
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -27,7 +37,7 @@ logger = logging.getLogger(__name__)
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 if ANTHROPIC_API_KEY:
     import anthropic
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+    client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
     logger.info("✅ Claude Haiku 3.5 configured for CSV analysis")
 else:
     client = None
@@ -35,9 +45,11 @@ else:
 
 # Use available model from your Free Tier plan
 MODEL_NAME = "claude-3-5-haiku-latest"  # Free-tier model, fast and light
-MAX_RETRIES = 3
-RETRY_DELAY = 1  # seconds
 MAX_TOKENS = 4096
+PROMPT_MAX_COLUMNS = 20  # Wide CSVs: prompt tables show the first and last 10 columns
+
+# CSV input: text, or a seekable binary file that pandas decodes while parsing
+CsvSource = Union[str, IO[bytes]]
 
 
 
@@ -45,7 +57,165 @@ MAX_TOKENS = 4096
 # ============================================
 # IN-MEMORY SESSION STORAGE
 # ============================================
-csv_sessions = {}
+# Sessions expire 24h after creation. The cache is bounded by the total
+# DataFrame memory of its sessions (least recently used are evicted first)
+CSV_SESSION_MEMORY_MB = int(os.getenv("CSV_SESSION_MEMORY_MB", "1024"))
+CSV_SESSION_TTL = 24 * 3600  # seconds
+csv_sessions = TTLCache(
+    maxsize=CSV_SESSION_MEMORY_MB * 1024 * 1024,
+    ttl=CSV_SESSION_TTL,
+    getsizeof=lambda session: session["nbytes"]
+)
+_sessions_lock = threading.Lock()  # TTLCache is not thread-safe
+
+MAX_HISTORY_MESSAGES = 200  # Oldest messages drop off a session's deque
+HISTORY_TOKEN_BUDGET = 2000  # Approximate tokens of history in AI prompts (data summary comes on top)
+
+
+def _get_session(session_id: str) -> Dict | None:
+    """Look up a session under the cache lock."""
+    with _sessions_lock:
+        return csv_sessions.get(session_id)
+
+
+# ============================================
+# SHARED SESSION STORE (Redis, optional)
+# ============================================
+# With REDIS_URL set, sessions are also written to Redis so any worker can
+# serve them: the DataFrame as zstd Parquet, metadata in a hash, and history
+# as a list of JSON messages (RPUSH is atomic, so concurrent workers never
+# overwrite each other's turns).
+# The in-process cache above stays in front as a read-through cache.
+
+
+def _session_keys(session_id: str) -> tuple:
+    """Redis keys for a session's DataFrame, metadata hash and history list."""
+    return f"csv:{session_id}:df", f"csv:{session_id}:meta", f"csv:{session_id}:hist"
+
+
+def _dump_message(message: CsvChatMessage) -> bytes:
+    """Serialize a message, keeping the raw ns timestamp so it round-trips."""
+    return orjson.dumps({
+        "role": message.role,
+        "content": message.content,
+        "plot_url": message.plot_url,
+        "timestamp": message.timestamp
+    })
+
+
+def _load_history(items: List[bytes]) -> deque:
+    """Rebuild a session's history deque from its Redis list."""
+    return deque(
+        (CsvChatMessage(**orjson.loads(item)) for item in items),
+        maxlen=MAX_HISTORY_MESSAGES
+    )
+
+
+def _to_parquet(df: pd.DataFrame) -> bytes:
+    """Encode a DataFrame as zstd-compressed Parquet."""
+    buffer = BytesIO()
+    df.to_parquet(buffer, engine="pyarrow", compression="zstd")
+    return buffer.getvalue()
+
+
+async def _store_session(session_id: str, session: Dict) -> None:
+    """Write a new session to Redis (no-op without Redis)."""
+    redis = get_redis()
+    if redis is None:
+        return
+    
+    try:
+        parquet = await asyncio.to_thread(_to_parquet, session["df"])
+        df_key, meta_key, hist_key = _session_keys(session_id)
+        
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.set(df_key, parquet, ex=CSV_SESSION_TTL)
+            pipe.hset(meta_key, mapping={
+                "csv_info": orjson.dumps(session["csv_info"]),
+                "summary_cache": orjson.dumps(session["summary_cache"]),
+                "created_at": session["created_at"].isoformat()
+            })
+            pipe.expire(meta_key, CSV_SESSION_TTL)
+            pipe.rpush(hist_key, *(_dump_message(m) for m in session["conversation_history"]))
+            pipe.expire(hist_key, CSV_SESSION_TTL)
+            await pipe.execute()
+        
+        logger.info(f"💾 Stored session {session_id} in Redis ({len(parquet) / 1024:.1f} KB Parquet)")
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to store session {session_id} in Redis: {e}")
+
+
+async def _store_turn(session_id: str, turn: List[CsvChatMessage]) -> None:
+    """Append a completed exchange to the session's Redis history (no-op without Redis)."""
+    redis = get_redis()
+    if redis is None:
+        return
+    
+    try:
+        _, _, hist_key = _session_keys(session_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(hist_key, *(_dump_message(m) for m in turn))
+            pipe.ltrim(hist_key, -MAX_HISTORY_MESSAGES, -1)
+            length, _ = await pipe.execute()
+        
+        # The list already expired (session kept alive by this worker's cache):
+        # RPUSH recreated it without a TTL. Plain EXPIRE works on any Redis
+        # version, unlike EXPIRE ... NX (7.0+).
+        if length == len(turn):
+            await redis.expire(hist_key, CSV_SESSION_TTL)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to store history for {session_id} in Redis: {e}")
+
+
+async def _load_session(session_id: str) -> Dict | None:
+    """
+    Get a session from the in-process cache, falling back to Redis.
+    With Redis, history is re-read on every call (another worker may have
+    appended to it); the DataFrame is only decoded on a local miss.
+    """
+    session = _get_session(session_id)
+    redis = get_redis()
+    if redis is None:
+        return session
+    
+    df_key, meta_key, hist_key = _session_keys(session_id)
+    try:
+        if session is not None:
+            history = await redis.lrange(hist_key, 0, -1)
+            if history:
+                session["conversation_history"] = _load_history(history)
+            return session
+        
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(df_key)
+            pipe.hgetall(meta_key)
+            pipe.lrange(hist_key, 0, -1)
+            parquet, meta, history = await pipe.execute()
+        if parquet is None or not meta:
+            return None
+        
+        meta = {key.decode(): value for key, value in meta.items()}
+        df = await asyncio.to_thread(pd.read_parquet, BytesIO(parquet))
+        nbytes = await asyncio.to_thread(_dataframe_nbytes, df)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to load session {session_id} from Redis: {e}")
+        return session
+    
+    session = {
+        "df": df,
+        "nbytes": nbytes,
+        "plot_columns": _plot_columns(df),
+        "summary_cache": orjson.loads(meta["summary_cache"]),
+        "conversation_history": _load_history(history),
+        "csv_info": orjson.loads(meta["csv_info"]),
+        "created_at": datetime.fromisoformat(meta["created_at"].decode())
+    }
+    if nbytes <= csv_sessions.maxsize:
+        with _sessions_lock:
+            csv_sessions[session_id] = session
+    
+    logger.info(f"📥 Loaded session {session_id} from Redis")
+    return session
 
 
 def _generate_session_id() -> str:
@@ -53,50 +223,151 @@ def _generate_session_id() -> str:
     return f"csv_{uuid.uuid4().hex[:12]}"
 
 
+# ============================================
+# PLOT STORAGE
+# ============================================
+# Rendered plots are served by GET /csv/plot/{plot_id} instead of base64-in-JSON.
+# Plot IDs are random UUIDs and expire, so the URL acts as a short-lived signed link.
+# With REDIS_URL set, plots live in Redis so any worker can serve them; they
+# last as long as a session, so plot URLs in chat history stay valid.
+PLOT_URL_PREFIX = "/csv/plot"
+PLOT_CACHE_SIZE = 512
+PLOT_CACHE_TTL = CSV_SESSION_TTL  # seconds
+csv_plots = TTLCache(maxsize=PLOT_CACHE_SIZE, ttl=PLOT_CACHE_TTL)
+_plots_lock = threading.Lock()  # TTLCache is not thread-safe
+_plot_local = threading.local()  # One reusable Figure per render thread (no pyplot)
+MAX_PLOT_POINTS = 5000  # Line/scatter data is downsampled to roughly the image's resolution
+PLOT_DPI = 100
+HIST_DPI = 80  # Histograms are a few bars; a smaller image renders and transfers faster
+# Lossless WebP (Pillow, fastest method): smaller than matplotlib's zlib-6
+# PNG and quicker to encode
+PLOT_FORMAT = "webp"
+PLOT_MEDIA_TYPE = "image/webp"
+PLOT_PIL_KWARGS = {"lossless": True, "method": 0}
+HIST_BINS = 30
+HIST_UNIQUE_CHECK_MAX = 10_000  # Only small columns pay for np.unique to shrink the bin count
+
+# Request keywords, compiled once; a leading word boundary still matches
+# plurals/inflections ("charts", "trending") but not e.g. "paragraph"
+_PLOT_RE = re.compile(r"\b(?:plot|graph|chart|visuali[sz]e|histogram|show distribution)", re.IGNORECASE)
+_SCATTER_RE = re.compile(r"\b(?:scatter|correlation)", re.IGNORECASE)
+_LINE_RE = re.compile(r"\b(?:line|trend)", re.IGNORECASE)
+
+PLOT_FAILED_MESSAGE = "⚠️ Could not generate the requested plot."
+
+# Requests pandas answers directly (no Claude call); anchored to the whole
+# message so only plain requests match, e.g. the fallback message's hints.
+# One pattern, one pass: the named group that matched is the request kind.
+_QUICK_RE = re.compile(
+    r"^\s*(?:"
+    r"(?P<head>show\s+(?:me\s+)?(?:the\s+)?(?:first|top|head)\s*(?P<n>\d+)?\s*(?:rows?)?)"
+    r"|(?P<stats>(?:show\s+(?:me\s+)?(?:the\s+)?)?(?:statistics|stats|summary statistics|describe))"
+    r"|(?P<missing>(?:what|which)\s+columns\s+(?:have|has|contain)\s+(?:missing|null|nan|empty)\s+values)"
+    r")\s*[.!?]*\s*$",
+    re.IGNORECASE
+)
+QUICK_HEAD_DEFAULT = 5
+QUICK_HEAD_MAX = 50
+
+
+async def save_plot(image_bytes: bytes) -> str:
+    """Store a rendered plot image and return the URL it is served from."""
+    plot_id = uuid.uuid4().hex
+    
+    redis = get_redis()
+    if redis is not None:
+        try:
+            await redis.set(f"plot:{plot_id}", image_bytes, ex=PLOT_CACHE_TTL)
+            return f"{PLOT_URL_PREFIX}/{plot_id}"
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to store plot {plot_id} in Redis, keeping it in-process: {e}")
+    
+    with _plots_lock:
+        csv_plots[plot_id] = image_bytes
+    return f"{PLOT_URL_PREFIX}/{plot_id}"
+
+
+async def get_plot(plot_id: str) -> bytes | None:
+    """Get a stored plot image by ID (None if unknown or expired)."""
+    with _plots_lock:
+        image_bytes = csv_plots.get(plot_id)
+    if image_bytes is not None:
+        return image_bytes
+    
+    redis = get_redis()
+    if redis is None:
+        return None
+    
+    try:
+        return await redis.get(f"plot:{plot_id}")
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to load plot {plot_id} from Redis: {e}")
+        return None
+
+
 # ============================================
 # AI HELPER WITH RETRY LOGIC
 # ============================================
 
 async def _call_ai_with_retry(prompt: str) -> str:
     """
-    Call Claude AI with automatic retry on failures.
+    Call Claude under the shared rate limiter, retrying transient errors
+    (see with_retry); falls back to a canned message if the call fails.
     """
     if not client:
         return _simple_fallback_message()
     
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.info(f"🤖 Claude 3.5 Sonnet: Attempt {attempt + 1}/{MAX_RETRIES}")
-            
-            message = client.messages.create(
+    async def call():
+        async with anthropic_limiter:
+            return await client.messages.create(
                 model=MODEL_NAME,
                 max_tokens=MAX_TOKENS,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
             )
-            
-            logger.info("✅ Claude response received successfully")
-            return message.content[0].text.strip()
-            
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"❌ Claude error (attempt {attempt + 1}): {error_msg}")
-            
-            # Check if it's a retryable error (529, rate_limit, overloaded)
-            is_retryable = any(code in error_msg for code in ["529", "overloaded", "rate_limit", "500", "503"])
-            
-            if is_retryable and attempt < MAX_RETRIES - 1:
-                wait_time = RETRY_DELAY * (2 ** attempt)  # Exponential backoff: 1s, 2s, 4s
-                logger.info(f"⏳ Retrying in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
-                continue
-            
-            # If not retryable or last attempt, use fallback
-            logger.warning("⚠️ All retries exhausted, using simple fallback")
-            return _simple_fallback_message()
     
-    return _simple_fallback_message()
+    try:
+        logger.info(f"🤖 Calling Claude ({MODEL_NAME})...")
+        message = await with_retry(call)
+    except Exception as e:
+        logger.error(f"❌ Claude error, using simple fallback: {e}")
+        return _simple_fallback_message()
+    
+    logger.info(
+        f"✅ Claude response received successfully "
+        f"(tokens in={message.usage.input_tokens}, out={message.usage.output_tokens})"
+    )
+    return message.content[0].text.strip()
+
+
+async def _stream_ai(prompt: str) -> AsyncIterator[str]:
+    """
+    Stream Claude's reply as text chunks.
+    Not retried once output has started; falls back if nothing was produced.
+    """
+    if not client:
+        yield _simple_fallback_message()
+        return
+    
+    produced = False
+    try:
+        async with anthropic_limiter:
+            async with client.messages.stream(
+                model=MODEL_NAME,
+                max_tokens=MAX_TOKENS,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            ) as stream:
+                async for text in stream.text_stream:
+                    produced = True
+                    yield text
+    
+    except Exception as e:
+        logger.error(f"❌ Claude stream error: {e}")
+        if not produced:
+            yield _simple_fallback_message()
 
 
 def _simple_fallback_message() -> str:
@@ -116,14 +387,35 @@ Or wait a moment and try your question again."""
 # ============================================
 
 async def create_csv_session(
-    csv_content: str,
+    source: CsvSource,
     source_type: str,
     source_value: str,
     initial_message: str
 ) -> Dict:
-    """Create a new CSV chat session."""
+    """
+    Create a new CSV chat session.
+    
+    Args:
+        source: CSV text, or a seekable binary file (read once, not retained)
+        source_type: "url" or "file"
+        source_value: URL or filename, for display
+        initial_message: First user message for the AI overview
+    """
     try:
-        df = _parse_csv_robust(csv_content)
+        df = await asyncio.to_thread(_parse_csv_robust, source)
+        # The CSV never changes within a session; render its prompt text once,
+        # sharing it with analyze_csv (and earlier sessions) for identical content
+        key = await asyncio.to_thread(_content_key, source)
+        parsed = _parsed_cache.get(key)
+        if parsed is None:
+            summary = await asyncio.to_thread(_summarize_dataframe, df)
+            _parsed_cache[key] = (df.shape, summary)
+        else:
+            summary = parsed[1]
+            logger.info("⚡ Reusing parsed CSV summary (same content)")
+        nbytes = await asyncio.to_thread(_dataframe_nbytes, df)
+        if nbytes > csv_sessions.maxsize:
+            raise ValueError(f"CSV needs {nbytes // (1024 * 1024)} MB in memory, above the session limit")
         session_id = _generate_session_id()
         
         csv_info = {
@@ -136,20 +428,25 @@ async def create_csv_session(
         }
         
         # Get AI's initial response with retry
-        initial_analysis = await _ai_initial_analysis(df, initial_message)
+        initial_analysis = await _ai_initial_analysis(df, summary, initial_message)
         
-        conversation_history = [
-            CsvChatMessage(role="user", content=initial_message, timestamp=datetime.now()),
-            CsvChatMessage(role="assistant", content=initial_analysis, timestamp=datetime.now())
-        ]
+        conversation_history = deque([
+            CsvChatMessage(role="user", content=initial_message),
+            CsvChatMessage(role="assistant", content=initial_analysis)
+        ], maxlen=MAX_HISTORY_MESSAGES)
         
-        csv_sessions[session_id] = {
+        session = {
             "df": df,
-            "csv_content": csv_content,
+            "nbytes": nbytes,
+            "plot_columns": _plot_columns(df),
+            "summary_cache": summary,
             "conversation_history": conversation_history,
             "csv_info": csv_info,
             "created_at": datetime.now()
         }
+        with _sessions_lock:
+            csv_sessions[session_id] = session
+        await _store_session(session_id, session)
         
         logger.info(f"✅ Created session: {session_id} ({df.shape[0]} rows, {df.shape[1]} cols)")
         
@@ -159,57 +456,98 @@ async def create_csv_session(
             "csv_info": csv_info
         }
         
+    except UnicodeDecodeError:
+        raise
     except Exception as e:
         logger.error(f"❌ Session creation failed: {e}")
         raise Exception(f"Failed to create session: {str(e)}")
 
 
-async def chat_with_csv(session_id: str, user_message: str) -> Dict:
-    """Continue conversation in an existing CSV session."""
-    session = csv_sessions.get(session_id)
+def _tail(history: deque, limit: int | None) -> List[CsvChatMessage]:
+    """Return the last `limit` messages as a list (all of them if limit is None)."""
+    if limit is None:
+        return list(history)
+    return list(islice(history, max(len(history) - limit, 0), None))
+
+
+async def chat_with_csv(
+    session_id: str,
+    user_message: str,
+    history_limit: int | None = None
+) -> Dict:
+    """
+    Continue conversation in an existing CSV session.
+    
+    Args:
+        session_id: Session ID
+        user_message: User's message
+        history_limit: Return only the last N messages (None for the full history)
+    """
+    session = await _load_session(session_id)
     if not session:
         raise ValueError(f"Session not found: {session_id}")
     
     df = session["df"]
+    summary = session["summary_cache"]
     conversation_history = session["conversation_history"]
     
     try:
-        user_msg = CsvChatMessage(role="user", content=user_message, timestamp=datetime.now())
+        # Prompt context is taken before the new user message is appended
+        recent = recent_within_budget(
+            conversation_history, HISTORY_TOKEN_BUDGET, lambda msg: msg.content
+        )
+        
+        user_msg = CsvChatMessage(role="user", content=user_message)
         conversation_history.append(user_msg)
         
         logger.info(f"💬 Processing message: {user_message[:50]}...")
         
+        # Plain requests ("show me the first 10 rows") are answered by pandas
+        quick_reply = await asyncio.to_thread(_quick_answer, df, summary, user_message)
+        if quick_reply is not None:
+            assistant_msg = CsvChatMessage(role="assistant", content=quick_reply)
+            conversation_history.append(assistant_msg)
+            await _store_turn(session_id, [user_msg, assistant_msg])
+            
+            return {
+                "session_id": session_id,
+                "reply": quick_reply,
+                "plot_url": None,
+                "conversation_history": _tail(conversation_history, history_limit)
+            }
+        
         # Check if user wants a plot
-        needs_plot = any(word in user_message.lower() for word in [
-            "plot", "graph", "chart", "visualize", "histogram", "show distribution"
-        ])
+        needs_plot = _PLOT_RE.search(user_message) is not None
         
         if needs_plot:
-            analysis, plot_base64 = await _ai_analyze_with_plot(df, user_message, conversation_history[:-1])
+            analysis, plot_url = await _ai_analyze_with_plot(
+                df, summary, session["plot_columns"], user_message, recent
+            )
             assistant_msg = CsvChatMessage(
                 role="assistant",
                 content=analysis,
-                plot_base64=plot_base64,
-                timestamp=datetime.now()
+                plot_url=plot_url
             )
             conversation_history.append(assistant_msg)
+            await _store_turn(session_id, [user_msg, assistant_msg])
             
             return {
                 "session_id": session_id,
                 "reply": analysis,
-                "plot_base64": plot_base64,
-                "conversation_history": conversation_history
+                "plot_url": plot_url,
+                "conversation_history": _tail(conversation_history, history_limit)
             }
         else:
-            analysis = await _ai_conversational_analysis(df, user_message, conversation_history[:-1])
-            assistant_msg = CsvChatMessage(role="assistant", content=analysis, timestamp=datetime.now())
+            analysis = await _ai_conversational_analysis(df, summary, user_message, recent)
+            assistant_msg = CsvChatMessage(role="assistant", content=analysis)
             conversation_history.append(assistant_msg)
+            await _store_turn(session_id, [user_msg, assistant_msg])
             
             return {
                 "session_id": session_id,
                 "reply": analysis,
-                "plot_base64": None,
-                "conversation_history": conversation_history
+                "plot_url": None,
+                "conversation_history": _tail(conversation_history, history_limit)
             }
         
     except Exception as e:
@@ -217,16 +555,81 @@ async def chat_with_csv(session_id: str, user_message: str) -> Dict:
         raise Exception(f"Chat failed: {str(e)}")
 
 
-def get_session_info(session_id: str) -> Dict:
+async def stream_chat_with_csv(session_id: str, user_message: str) -> AsyncIterator[Dict]:
+    """
+    Streaming variant of chat_with_csv.
+    
+    Args:
+        session_id: Session ID
+        user_message: User's message
+    
+    Returns:
+        Async iterator of events: {"plot_url": ...} once for plot requests,
+        then {"text": ...} chunks as Claude produces them
+    
+    Raises:
+        ValueError: If the session does not exist (before streaming starts)
+    """
+    session = await _load_session(session_id)
+    if not session:
+        raise ValueError(f"Session not found: {session_id}")
+    
+    return _stream_chat_events(session_id, session, user_message)
+
+
+async def _stream_chat_events(session_id: str, session: Dict, user_message: str) -> AsyncIterator[Dict]:
+    """Produce stream_chat_with_csv events; the reply is recorded once complete."""
+    df = session["df"]
+    summary = session["summary_cache"]
+    conversation_history = session["conversation_history"]
+    
+    recent = recent_within_budget(
+        conversation_history, HISTORY_TOKEN_BUDGET, lambda msg: msg.content
+    )
+    user_msg = CsvChatMessage(role="user", content=user_message)
+    conversation_history.append(user_msg)
+    
+    logger.info(f"💬 Streaming reply for: {user_message[:50]}...")
+    
+    plot_url = None
+    prompt = None
+    # Plain requests are answered by pandas; otherwise plot and/or ask Claude
+    reply = await asyncio.to_thread(_quick_answer, df, summary, user_message)
+    if reply is None and _PLOT_RE.search(user_message):
+        image_bytes = await _generate_smart_plot(df, session["plot_columns"], user_message)
+        if image_bytes:
+            plot_url = await save_plot(image_bytes)
+            yield {"plot_url": plot_url}
+            prompt = _build_plot_prompt(df, summary, user_message, recent)
+        else:
+            reply = PLOT_FAILED_MESSAGE
+    elif reply is None:
+        prompt = _build_chat_prompt(df, summary, user_message, recent)
+    
+    if prompt is None:
+        yield {"text": reply}
+    else:
+        chunks = []
+        async for text in _stream_ai(prompt):
+            chunks.append(text)
+            yield {"text": text}
+        reply = "".join(chunks).strip()
+    
+    assistant_msg = CsvChatMessage(role="assistant", content=reply, plot_url=plot_url)
+    conversation_history.append(assistant_msg)
+    await _store_turn(session_id, [user_msg, assistant_msg])
+
+
+async def get_session_info(session_id: str) -> Dict:
     """Get information about a session."""
-    session = csv_sessions.get(session_id)
+    session = await _load_session(session_id)
     if not session:
         return None
     
     return {
         "session_id": session_id,
         "csv_info": session["csv_info"],
-        "conversation_history": session["conversation_history"],
+        "conversation_history": list(session["conversation_history"]),
         "created_at": session["created_at"].isoformat()
     }
 
@@ -235,23 +638,23 @@ def get_session_info(session_id: str) -> Dict:
 # AI ANALYSIS FUNCTIONS
 # ============================================
 
-async def _ai_initial_analysis(df: pd.DataFrame, initial_message: str) -> str:
+async def _ai_initial_analysis(df: pd.DataFrame, summary: Dict[str, str], initial_message: str) -> str:
     """AI generates initial analysis/overview of the CSV."""
     prompt = f"""You are a helpful data analysis assistant. A user has just uploaded a CSV file.
 
 Dataset Information:
 - Rows: {df.shape[0]:,}
 - Columns: {df.shape[1]}
-- Column Names: {', '.join(df.columns.tolist())}
+- Column Names: {summary["columns"]}
 
 Data Types:
-{df.dtypes.to_string()}
+{summary["dtypes"]}
 
 First 5 Rows:
-{df.head().to_string()}
+{summary["head_5"]}
 
 Statistical Summary:
-{df.describe().to_string()}
+{summary["describe"]}
 
 User's Initial Message: "{initial_message}"
 
@@ -267,24 +670,36 @@ Use markdown formatting."""
 
 async def _ai_conversational_analysis(
     df: pd.DataFrame,
+    summary: Dict[str, str],
     user_message: str,
     conversation_history: List[CsvChatMessage]
 ) -> str:
     """AI analyzes CSV with full conversation context."""
+    prompt = _build_chat_prompt(df, summary, user_message, conversation_history)
+    return await _call_ai_with_retry(prompt)
+
+
+def _build_chat_prompt(
+    df: pd.DataFrame,
+    summary: Dict[str, str],
+    user_message: str,
+    conversation_history: List[CsvChatMessage]
+) -> str:
+    """Build the conversational analysis prompt."""
     context = _build_conversation_context(conversation_history)
     
-    prompt = f"""You are a helpful data analysis assistant having a conversation about a CSV dataset.
+    return f"""You are a helpful data analysis assistant having a conversation about a CSV dataset.
 
 Dataset Information:
 - Rows: {df.shape[0]:,}
 - Columns: {df.shape[1]}
-- Column Names: {', '.join(df.columns.tolist())}
+- Column Names: {summary["columns"]}
 
 Data Sample:
-{df.head(10).to_string()}
+{summary["head_10"]}
 
 Statistical Summary:
-{df.describe().to_string()}
+{summary["describe"]}
 
 Previous Conversation:
 {context}
@@ -299,28 +714,44 @@ Analyze the data and answer the user's question. Consider:
 5. Be conversational and friendly
 
 Provide a clear, detailed response."""
-    
-    return await _call_ai_with_retry(prompt)
 
 
 async def _ai_analyze_with_plot(
     df: pd.DataFrame,
+    summary: Dict[str, str],
+    plot_columns: Dict,
     user_message: str,
     conversation_history: List[CsvChatMessage]
 ) -> tuple:
     """AI analyzes and generates a plot based on user request."""
     try:
-        plot_base64 = await _generate_smart_plot(df, user_message)
+        image_bytes = await _generate_smart_plot(df, plot_columns, user_message)
         
-        if not plot_base64:
-            return ("⚠️ Could not generate the requested plot.", None)
+        if not image_bytes:
+            return (PLOT_FAILED_MESSAGE, None)
         
-        context = _build_conversation_context(conversation_history)
+        prompt = _build_plot_prompt(df, summary, user_message, conversation_history)
+        analysis = await _call_ai_with_retry(prompt)
+        return (analysis, await save_plot(image_bytes))
         
-        prompt = f"""You've created a visualization for the user.
+    except Exception as e:
+        logger.error(f"❌ Plot generation error: {e}")
+        return (f"⚠️ Error generating plot: {str(e)}", None)
+
+
+def _build_plot_prompt(
+    df: pd.DataFrame,
+    summary: Dict[str, str],
+    user_message: str,
+    conversation_history: List[CsvChatMessage]
+) -> str:
+    """Build the prompt that describes a freshly rendered plot."""
+    context = _build_conversation_context(conversation_history)
+    
+    return f"""You've created a visualization for the user.
 
 Dataset: {df.shape[0]:,} rows × {df.shape[1]} columns
-Columns: {', '.join(df.columns.tolist())}
+Columns: {summary["columns"]}
 
 Previous Conversation:
 {context}
@@ -333,26 +764,37 @@ A visualization has been created. Provide:
 3. Interesting observations
 
 Keep it concise. Use markdown."""
-        
-        analysis = await _call_ai_with_retry(prompt)
-        return (analysis, plot_base64)
-        
-    except Exception as e:
-        logger.error(f"❌ Plot generation error: {e}")
-        return (f"⚠️ Error generating plot: {str(e)}", None)
 
 
-async def _generate_smart_plot(df: pd.DataFrame, user_message: str) -> str:
-    """Intelligently generate plot based on user request."""
+async def _generate_smart_plot(df: pd.DataFrame, plot_columns: Dict, user_message: str) -> bytes | None:
+    """Intelligently generate plot based on user request. Returns image bytes (PLOT_FORMAT)."""
+    return await asyncio.to_thread(_render_smart_plot, df, plot_columns, user_message)
+
+
+def _plot_columns(df: pd.DataFrame) -> Dict:
+    """
+    Numeric columns, plus a lowercase-name lookup used to spot a column in a
+    request. Computed once per session instead of on every plot.
+    """
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    lookup = {}
+    for col in numeric_cols:
+        lookup.setdefault(str(col).lower(), col)  # First column wins on case clashes
+    return {"numeric": numeric_cols, "lookup": lookup}
+
+
+def _render_smart_plot(df: pd.DataFrame, plot_columns: Dict, user_message: str) -> bytes | None:
+    """Render the plot synchronously; runs in a worker thread."""
     try:
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+        numeric_cols = plot_columns["numeric"]
         if not numeric_cols:
             return None
         
         # Detect column
+        message_lower = user_message.lower()
         column_to_plot = None
-        for col in df.columns:
-            if col.lower() in user_message.lower() and col in numeric_cols:
+        for name, col in plot_columns["lookup"].items():
+            if name in message_lower:
                 column_to_plot = col
                 break
         
@@ -361,77 +803,231 @@ async def _generate_smart_plot(df: pd.DataFrame, user_message: str) -> str:
         
         logger.info(f"📊 Creating plot for: {column_to_plot}")
         
-        plt.figure(figsize=(10, 6))
+        return _draw_plot(df, user_message, numeric_cols, column_to_plot)
+        
+    except Exception as e:
+        logger.error(f"❌ Plot error: {e}")
+        return None
+
+
+def _draw_plot(
+    df: pd.DataFrame,
+    user_message: str,
+    numeric_cols: List[str],
+    column_to_plot: str
+) -> bytes:
+    """Draw the chosen plot on this thread's reusable Figure and return image bytes."""
+    fig = _get_figure()
+    ax = fig.add_subplot()
+    dpi = PLOT_DPI
+    try:
         data = df[column_to_plot].dropna()
         
         # Choose plot type
-        if any(word in user_message.lower() for word in ["scatter", "correlation"]) and len(numeric_cols) >= 2:
-            plt.scatter(df[numeric_cols[0]], df[numeric_cols[1]], alpha=0.6)
-            plt.xlabel(numeric_cols[0])
-            plt.ylabel(numeric_cols[1])
-            plt.title(f'Scatter: {numeric_cols[0]} vs {numeric_cols[1]}')
-        elif any(word in user_message.lower() for word in ["line", "trend"]):
-            plt.plot(data.values, linewidth=2)
-            plt.xlabel('Index')
-            plt.ylabel(column_to_plot)
-            plt.title(f'Trend: {column_to_plot}')
+        if _SCATTER_RE.search(user_message) and len(numeric_cols) >= 2:
+            x, y = df[numeric_cols[0]].to_numpy(), df[numeric_cols[1]].to_numpy()
+            if len(x) > MAX_PLOT_POINTS:
+                # Fixed seed: the same CSV and request always give the same image
+                idx = np.random.default_rng(0).choice(len(x), MAX_PLOT_POINTS, replace=False)
+                x, y = x[idx], y[idx]
+            ax.scatter(x, y, alpha=0.6)
+            ax.set_xlabel(numeric_cols[0])
+            ax.set_ylabel(numeric_cols[1])
+            ax.set_title(f'Scatter: {numeric_cols[0]} vs {numeric_cols[1]}')
+        elif _LINE_RE.search(user_message):
+            # Keep every step-th point, plotted at its original row position
+            step = max(1, len(data) // MAX_PLOT_POINTS)
+            ax.plot(np.arange(0, len(data), step), data.to_numpy()[::step], linewidth=2)
+            ax.set_xlabel('Index')
+            ax.set_ylabel(column_to_plot)
+            ax.set_title(f'Trend: {column_to_plot}')
         else:
-            plt.hist(data, bins=min(30, len(data.unique())), edgecolor='black', alpha=0.7)
-            plt.xlabel(column_to_plot)
-            plt.ylabel('Frequency')
-            plt.title(f'Distribution of {column_to_plot}')
+            # One np.histogram pass on a float ndarray, drawn as bars
+            arr = data.to_numpy(dtype=np.float64, na_value=np.nan)
+            arr = arr[np.isfinite(arr)]
+            bins = HIST_BINS
+            if arr.size <= HIST_UNIQUE_CHECK_MAX:
+                bins = max(1, min(HIST_BINS, np.unique(arr).size))
+            counts, edges = np.histogram(arr, bins=bins)
+            ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', edgecolor='black', alpha=0.7)
+            dpi = HIST_DPI
+            ax.set_xlabel(column_to_plot)
+            ax.set_ylabel('Frequency')
+            ax.set_title(f'Distribution of {column_to_plot}')
         
-        plt.grid(axis='y', alpha=0.3)
+        ax.grid(axis='y', alpha=0.3)
         
         buffer = BytesIO()
-        plt.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
-        buffer.seek(0)
-        plot_base64 = base64.b64encode(buffer.read()).decode()
-        plt.close()
+        fig.savefig(buffer, format=PLOT_FORMAT, dpi=dpi, bbox_inches='tight', pil_kwargs=PLOT_PIL_KWARGS)
         
-        return plot_base64
+        return buffer.getvalue()
         
-    except Exception as e:
-        logger.error(f"❌ Plot error: {e}")
+    finally:
+        fig.clear()  # Drop this plot's artists (and data) before the next reuse
+
+
+def _get_figure() -> Figure:
+    """
+    Return this thread's Figure, creating it (and its Agg canvas) on first use.
+    Figures are not thread-safe, so each render thread gets its own.
+    """
+    fig = getattr(_plot_local, "figure", None)
+    if fig is None:
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        _plot_local.figure = fig
+    return fig
+
+
+def _quick_answer(df: pd.DataFrame, summary: Dict[str, str], user_message: str) -> str | None:
+    """
+    Answer plain data requests (first rows, statistics, missing values) with pandas.
+    Returns None when the message needs the AI.
+    """
+    match = _QUICK_RE.match(user_message)
+    if match is None:
         return None
+    
+    if match.group("head"):
+        n = min(int(match.group("n") or QUICK_HEAD_DEFAULT), QUICK_HEAD_MAX)
+        return f"**First {n} rows:**\n\n```\n{df.head(n).to_string()}\n```"
+    
+    if match.group("stats"):
+        return f"**Statistical summary:**\n\n```\n{summary['describe_full']}\n```"
+    
+    return _missing_values_report(df)
+
+
+def _missing_values_report(df: pd.DataFrame) -> str:
+    """
+    Count missing values column by column (no full-size boolean DataFrame)
+    and only build the table when something is missing.
+    """
+    missing = np.fromiter(
+        (df[col].isna().to_numpy().sum() for col in df.columns),
+        dtype=np.int64,
+        count=df.shape[1]
+    )
+    if not missing.any():
+        return "No columns have missing values."
+    
+    mask = missing > 0
+    report = pd.DataFrame({
+        "Missing Values": missing[mask],
+        "Percentage": (missing[mask] * (100.0 / len(df))).round(2)
+    }, index=df.columns[mask])
+    return f"**Missing values per column:**\n\n```\n{report.to_string()}\n```"
+
+
+def _summarize_dataframe(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    Render the DataFrame text used in AI prompts.
+    describe() scans every numeric column, so sessions compute this once.
+    Prompt tables are capped at PROMPT_MAX_COLUMNS so wide CSVs don't blow
+    up the prompt; "describe_full" keeps every column for direct replies.
+    """
+    stats = df.describe()
+    with pd.option_context("display.width", 200):
+        return {
+            "columns": ", ".join(map(str, df.columns)),
+            "dtypes": df.dtypes.to_string(),
+            "head_5": df.head(5).to_string(max_cols=PROMPT_MAX_COLUMNS),
+            "head_10": df.head(10).to_string(max_cols=PROMPT_MAX_COLUMNS),
+            "describe": stats.to_string(max_cols=PROMPT_MAX_COLUMNS),
+            "describe_full": stats.to_string()
+        }
+
+
+def _dataframe_nbytes(df: pd.DataFrame) -> int:
+    """Memory held by a DataFrame, including string contents (sizes the session cache)."""
+    return int(df.memory_usage(deep=True).sum())
 
 
 def _build_conversation_context(history: List[CsvChatMessage]) -> str:
-    """Build conversation context string."""
+    """Build conversation context string (history is already budget-trimmed)."""
     if not history:
         return "No previous conversation."
     
-    context_parts = []
-    for msg in history[-5:]:
-        role = "User" if msg.role == "user" else "Assistant"
-        context_parts.append(f"{role}: {msg.content}")
-    
-    return "\n".join(context_parts)
+    return "\n".join(
+        ("User: " if msg.role == "user" else "Assistant: ") + msg.content
+        for msg in history
+    )
 
 
 # ============================================
 # UTILITIES
 # ============================================
 
-def _parse_csv_robust(csv_content: str) -> pd.DataFrame:
-    """Robust CSV parser with multiple strategies."""
+# Parsed single-shot CSVs by content hash: (shape, summary). Only the
+# rendered text is kept, not the DataFrame, so entries are small.
+# Only touched from the event loop, so no thread lock is needed.
+PARSED_CACHE_SIZE = 256
+_parsed_cache = LRUCache(maxsize=PARSED_CACHE_SIZE)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _content_key(source: CsvSource) -> bytes:
+    """BLAKE2b digest of the CSV content (files are hashed in chunks)."""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, str):
+        digest.update(source.encode("utf-8", "surrogatepass"))
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _open_source(source: CsvSource):
+    """Return a readable buffer positioned at the start of the CSV."""
+    if isinstance(source, str):
+        return io.StringIO(source)
+    source.seek(0)
+    return source
+
+
+SNIFF_BYTES = 4096
+SNIFF_DELIMITERS = ",;\t|"
+
+
+def _sniff_separator(source: CsvSource) -> str:
+    """Guess the column separator from the start of the CSV (comma if unsure)."""
+    head = source[:SNIFF_BYTES] if isinstance(source, str) else _open_source(source).read(SNIFF_BYTES)
+    if isinstance(head, bytes):
+        head = head.decode("utf-8", errors="ignore")  # May cut a multi-byte char at the end
     try:
-        return pd.read_csv(io.StringIO(csv_content))
-    except:
-        pass
+        return csv.Sniffer().sniff(head, delimiters=SNIFF_DELIMITERS).delimiter
+    except csv.Error:
+        return ","
+
+
+def _parse_csv_robust(source: CsvSource) -> pd.DataFrame:
+    """
+    Robust CSV parser with multiple strategies.
+    Accepts CSV text or a seekable binary file (decoded by pandas while parsing).
+    """
+    sep = _sniff_separator(source)
     
+    # Multithreaded Arrow tokenizer first; it rejects ragged or oddly quoted
+    # files, which the C and Python engines below can still recover
     try:
-        return pd.read_csv(io.StringIO(csv_content), on_bad_lines='skip', engine='python')
-    except:
-        pass
+        buffer = io.BytesIO(source.encode("utf-8")) if isinstance(source, str) else _open_source(source)
+        return pd.read_csv(buffer, sep=sep, engine="pyarrow")
+    except Exception as e:
+        logger.warning(f"⚠️ PyArrow parse failed, falling back to C engine: {e}")
     
-    for sep in [',', ';', '\t', '|']:
-        try:
-            df = pd.read_csv(io.StringIO(csv_content), sep=sep, on_bad_lines='skip', engine='python')
-            if df.shape[1] > 1:
-                return df
-        except:
-            continue
+    # C engine with the sniffed separator, skipping malformed rows
+    try:
+        return pd.read_csv(_open_source(source), sep=sep, on_bad_lines='skip')
+    except pd.errors.ParserError as e:
+        # Only tokenizer errors (e.g. quoting the C parser rejects) are worth
+        # the much slower Python engine; encoding and empty-file errors are not
+        logger.warning(f"⚠️ C engine parse failed, retrying with Python engine: {e}")
+    
+    try:
+        return pd.read_csv(_open_source(source), sep=sep, on_bad_lines='skip', engine='python')
+    except pd.errors.ParserError:
+        pass
     
     raise Exception("Could not parse CSV file")
 
@@ -440,32 +1036,60 @@ def _parse_csv_robust(csv_content: str) -> pd.DataFrame:
 # BACKWARD COMPATIBILITY (Original endpoints)
 # ============================================
 
-async def analyze_csv(csv_content: str, prompt: str) -> Dict:
-    """Single-shot CSV analysis (backward compatible)."""
+async def analyze_csv(source: CsvSource, prompt: str) -> Dict:
+    """
+    Single-shot CSV analysis (backward compatible).
+    
+    Args:
+        source: CSV text, or a seekable binary file (e.g. a spooled upload)
+        prompt: User's analysis request
+    
+    Returns:
+        Dict with summary, plot_url, and cacheable (False for errors and AI fallbacks)
+    """
     try:
-        df = _parse_csv_robust(csv_content)
+        # Hashing, parsing and describe() are CPU-bound; keep them off the event loop
+        key = await asyncio.to_thread(_content_key, source)
+        parsed = _parsed_cache.get(key)
+        if parsed is None:
+            df = await asyncio.to_thread(_parse_csv_robust, source)
+            summary = await asyncio.to_thread(_summarize_dataframe, df)
+            parsed = _parsed_cache[key] = (df.shape, summary)
+        else:
+            logger.info("⚡ Reusing parsed CSV summary (same content)")
         
-        ai_prompt = f"""Analyze this CSV dataset:
+        ai_prompt = _build_analysis_prompt(*parsed, prompt)
+        
+        summary = await _call_ai_with_retry(ai_prompt)
+        return {
+            "summary": summary,
+            "plot_url": None,
+            "cacheable": summary != _simple_fallback_message()
+        }
+        
+    except UnicodeDecodeError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ CSV analysis error: {e}")
+        return {"summary": f"⚠️ Error: {str(e)}", "plot_url": None, "cacheable": False}
 
-Shape: {df.shape[0]:,} rows × {df.shape[1]} columns
-Columns: {', '.join(df.columns.tolist())}
+
+def _build_analysis_prompt(shape: tuple, summary: Dict[str, str], prompt: str) -> str:
+    """Build the single-shot analysis prompt from a parsed CSV's shape and summary."""
+    return f"""Analyze this CSV dataset:
+
+Shape: {shape[0]:,} rows × {shape[1]} columns
+Columns: {summary["columns"]}
 
 Data Types:
-{df.dtypes.to_string()}
+{summary["dtypes"]}
 
 First 10 Rows:
-{df.head(10).to_string()}
+{summary["head_10"]}
 
 Statistics:
-{df.describe().to_string()}
+{summary["describe"]}
 
 Question: {prompt}
 
-Provide clear analysis with markdown formatting."""
-        
-        summary = await _call_ai_with_retry(ai_prompt)
-        return {"summary": summary, "plot_base64": None}
-        
-    except Exception as e:
-        logger.error(f"❌ CSV analysis error: {e}")
-        return {"summary": f"⚠️ Error: {str(e)}", "plot_base64": None}
\ No newline at end of file
+Provide clear analysis with markdown formatting."""
\ No newline at end of file
@@ -0,0 +1,109 @@
+# backend/app/services/embedding_batcher.py
+"""
+Micro-batching layer for text embeddings.
+Coalesces embed requests from concurrent callers into one model.encode call.
+"""
+import asyncio
+import logging
+import numpy as np
+from typing import List
+from app.utils.micro_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+# Batching configuration
+MAX_BATCH_SIZE = 64  # Texts per model.encode call
+MAX_WAIT_SECONDS = 0.01  # Window to collect concurrent requests
+
+# Queue priorities: query embeddings jump ahead of queued document chunks
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class EmbeddingBatcher(MicroBatcher):
+    """
+    Collects pending texts from concurrent requests and embeds them
+    in a single batched forward pass. Batches are encoded one at a time:
+    model.encode already uses every core via torch's intra-op threads.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT_SECONDS
+    ):
+        super().__init__(max_batch_size, max_wait)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """
+        Queue a text and wait for its embedding.
+
+        Args:
+            text: Text to embed
+
+        Returns:
+            L2-normalized 384-dimensional float32 embedding vector
+        """
+        return await self._submit(text, PRIORITY_INTERACTIVE)
+
+    async def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Queue several texts at bulk priority; they share batches with other
+        callers but yield to interactive embed() calls.
+
+        Args:
+            texts: Texts to embed (e.g. a document's chunks)
+
+        Returns:
+            Embedding vectors in the same order as texts
+        """
+        # Enqueue everything at once (the queue is unbounded) so a document's
+        # chunks fill whole batches instead of trickling in one by one
+        futures = [self._submit(text, PRIORITY_BULK) for text in texts]
+        return list(await asyncio.gather(*futures))
+
+    async def _flush(self, batch: list) -> None:
+        """Encode one batch off the event loop and resolve its futures."""
+        # Imported here: rag_service itself routes embeddings through this batcher
+        from app.services.rag_service import get_embedding_model
+
+        texts = [text for text, _ in batch]
+
+        try:
+            model = get_embedding_model()
+            embeddings = await asyncio.to_thread(
+                model.encode,
+                texts,
+                batch_size=self.max_batch_size,
+                normalize_embeddings=True,  # Collection uses DOT distance
+                convert_to_numpy=True,
+                convert_to_tensor=False
+            )
+
+            # Vectors stay float32 arrays (no boxing into Python floats); each
+            # row is copied (and widened if the model runs in fp16) so a cached
+            # vector doesn't pin the whole batch
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding.astype(np.float32))
+
+        except Exception as e:
+            logger.error(f"❌ Batched embedding failed: {e}")
+            self._fail(batch, e)
+
+
+# Singleton instance
+_embedding_batcher = None
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """
+    Get singleton embedding batcher instance.
+    Initializes on first call, returns cached instance thereafter.
+    """
+    global _embedding_batcher
+
+    if _embedding_batcher is None:
+        _embedding_batcher = EmbeddingBatcher()
+
+    return _embedding_batcher
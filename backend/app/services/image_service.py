@@ -4,15 +4,22 @@ Image chat service using Claude Sonnet 4.5 Vision API.
 Supports multi-turn conversations about uploaded images.
 """
 import anthropic
+import asyncio
 import os
 import logging
 import base64
-from PIL import Image
+from PIL import Image, ImageOps
 from io import BytesIO
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict
 from datetime import datetime
 import uuid
+import time
+import threading
+import orjson
+from cachetools import TTLCache
+from app.database.redis_client import get_redis
+from app.utils.rate_limit import anthropic_limiter, with_retry
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -21,7 +28,7 @@ logger = logging.getLogger(__name__)
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 
 if ANTHROPIC_API_KEY:
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+    client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
     logger.info("✅ Claude Sonnet 4.5 configured for image chat")
 else:
     client = None
@@ -30,9 +37,122 @@ else:
 MODEL_NAME = "claude-sonnet-4-5-20250929"  # Fast, excellent vision quality
 MAX_TOKENS = 4096
 
-# In-memory storage for image chat sessions
-# TODO: Replace with database (Redis/PostgreSQL) for production
-image_chat_sessions = {}
+# Claude downsamples images beyond this long edge anyway; larger uploads are
+# resized before storing so every turn sends (and pays for) fewer bytes
+MAX_IMAGE_EDGE = 1568
+JPEG_QUALITY = 85
+
+# In-memory storage for image chat sessions (bounded, expires after 1 hour)
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "10000"))
+CHAT_CACHE_TTL = 3600  # seconds
+image_chat_sessions = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)
+_sessions_lock = threading.RLock()  # TTLCache is not thread-safe
+
+
+def _get_session(session_id: str) -> Dict | None:
+    """Look up a session under the cache lock."""
+    with _sessions_lock:
+        return image_chat_sessions.get(session_id)
+
+
+# ============================================
+# SHARED SESSION STORE (Redis, optional)
+# ============================================
+# With REDIS_URL set, sessions are also written to Redis so any worker can
+# serve them: image bytes and metadata in a hash, history as a list of JSON
+# turns (RPUSH is atomic, so concurrent workers never overwrite each other).
+# The in-process cache above stays in front as a read-through cache.
+
+
+def _session_keys(session_id: str) -> tuple:
+    """Redis keys for a session's image hash and history list."""
+    return f"imgchat:{session_id}", f"imgchat:{session_id}:hist"
+
+
+async def _store_session(session_id: str, session: Dict) -> None:
+    """Write a new session to Redis (no-op without Redis)."""
+    redis = get_redis()
+    if redis is None:
+        return
+    
+    try:
+        key, _ = _session_keys(session_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={
+                "bytes": session["image_bytes"],
+                "media_type": session["media_type"],
+                "filename": session["filename"],
+                "image_info": orjson.dumps(session["image_info"]),
+                "created_at": session["created_at"]
+            })
+            pipe.expire(key, CHAT_CACHE_TTL)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to store image session {session_id} in Redis: {e}")
+
+
+async def _store_turn(session_id: str, turn: List[Dict]) -> None:
+    """Append a completed exchange to the session's Redis history (no-op without Redis)."""
+    redis = get_redis()
+    if redis is None:
+        return
+    
+    try:
+        _, hist_key = _session_keys(session_id)
+        length = await redis.rpush(hist_key, *(orjson.dumps(msg) for msg in turn))
+        # First turn created the list: give it the session's TTL once. Plain
+        # EXPIRE works on any Redis version, unlike EXPIRE ... NX (7.0+).
+        if length == len(turn):
+            await redis.expire(hist_key, CHAT_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to store history for image session {session_id} in Redis: {e}")
+
+
+async def _load_session(session_id: str) -> Dict | None:
+    """
+    Get a session from the in-process cache, falling back to Redis.
+    With Redis, history is re-read on every call (another worker may have
+    appended to it); image and history come back in one pipelined round trip.
+    """
+    session = _get_session(session_id)
+    redis = get_redis()
+    if redis is None:
+        return session
+    
+    key, hist_key = _session_keys(session_id)
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            if session is None:
+                pipe.hgetall(key)
+            pipe.lrange(hist_key, 0, -1)
+            results = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to load image session {session_id} from Redis: {e}")
+        return session
+    
+    history = [orjson.loads(msg) for msg in results[-1]]
+    if session is not None:
+        session["conversation_history"] = history
+        return session
+    
+    meta = {field.decode(): value for field, value in results[0].items()}
+    if not meta:
+        return None
+    
+    session = {
+        "session_id": session_id,
+        "image_bytes": meta["bytes"],
+        "media_type": meta["media_type"].decode(),
+        "filename": meta["filename"].decode(),
+        "image_info": orjson.loads(meta["image_info"]),
+        "conversation_history": history,
+        "created_at": meta["created_at"].decode()
+    }
+    with _sessions_lock:
+        image_chat_sessions[session_id] = session
+    
+    logger.info(f"📥 Loaded image session {session_id} from Redis")
+    return session
 
 
 def get_image_media_type(image_data: bytes) -> str:
@@ -57,6 +177,40 @@ def get_image_media_type(image_data: bytes) -> str:
         return "image/jpeg"
 
 
+def _prepare_image(image_data: bytes) -> tuple:
+    """
+    Downscale an oversized image to MAX_IMAGE_EDGE and re-encode it.
+    Images already within the limit are kept byte-for-byte.
+    
+    Args:
+        image_data: Raw uploaded image bytes
+        
+    Returns:
+        (image bytes to store, media type, original PIL image size, original format)
+    """
+    image = Image.open(BytesIO(image_data))
+    original_size = image.size
+    format_name = image.format
+    
+    if max(original_size) <= MAX_IMAGE_EDGE:
+        return image_data, get_image_media_type(image_data), original_size, format_name
+    
+    # Re-encoding drops EXIF, so apply its orientation to the pixels first
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    
+    # PNG for transparency/palette images and screenshots, JPEG for photos
+    if image.mode in ("RGBA", "LA", "P") or format_name == "PNG":
+        image.save(buffer, "PNG", optimize=True)
+        media_type = "image/png"
+    else:
+        image.convert("RGB").save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        media_type = "image/jpeg"
+    
+    return buffer.getvalue(), media_type, original_size, format_name
+
+
 async def create_image_chat_session(image_data: bytes, filename: str) -> Dict:
     """
     Create a new image chat session with uploaded image.
@@ -72,31 +226,38 @@ async def create_image_chat_session(image_data: bytes, filename: str) -> Dict:
         # Generate unique session ID
         session_id = str(uuid.uuid4())
         
-        # Get image info
-        image = Image.open(BytesIO(image_data))
-        width, height = image.size
-        format_name = image.format
-        
-        # Convert to base64 for storage and API
-        image_base64 = base64.standard_b64encode(image_data).decode("utf-8")
-        media_type = get_image_media_type(image_data)
+        # Decode, resize and re-encode off the event loop
+        stored_data, media_type, (width, height), format_name = await asyncio.to_thread(
+            _prepare_image, image_data
+        )
+        if len(stored_data) < len(image_data):
+            logger.info(
+                f"🗜️ Image resized for {filename}: "
+                f"{len(image_data) / 1024:.0f} KB → {len(stored_data) / 1024:.0f} KB"
+            )
         
-        # Store session data
-        image_chat_sessions[session_id] = {
+        # Store session data (raw bytes; base64 is 33% larger and only
+        # needed while building each API request)
+        session_data = {
             "session_id": session_id,
-            "image_base64": image_base64,
+            "image_bytes": stored_data,
             "media_type": media_type,
             "filename": filename,
             "image_info": {
                 "width": width,
                 "height": height,
                 "format": format_name,
-                "size_kb": len(image_data) / 1024
+                "size_kb": len(image_data) / 1024,
+                "compressed_size_kb": len(stored_data) / 1024
             },
             "conversation_history": [],
             "created_at": datetime.now().isoformat()
         }
         
+        with _sessions_lock:
+            image_chat_sessions[session_id] = session_data
+        await _store_session(session_id, session_data)
+        
         logger.info(f"✅ Created image chat session {session_id} for {filename}")
         
         return {
@@ -107,7 +268,8 @@ async def create_image_chat_session(image_data: bytes, filename: str) -> Dict:
                 "width": width,
                 "height": height,
                 "format": format_name,
-                "size_kb": round(len(image_data) / 1024, 2)
+                "size_kb": round(len(image_data) / 1024, 2),
+                "compressed_size_kb": round(len(stored_data) / 1024, 2)
             }
         }
         
@@ -134,71 +296,33 @@ async def chat_with_image(session_id: str, user_message: str) -> Dict:
         }
     
     # Check if session exists
-    if session_id not in image_chat_sessions:
+    session = await _load_session(session_id)
+    if session is None:
         return {
             "reply": "⚠️ Session not found. Please upload an image first.",
             "conversation_history": []
         }
     
-    session = image_chat_sessions[session_id]
-    
     try:
         logger.info(f"💬 Image chat - Session {session_id[:8]}... - Question: {user_message[:50]}...")
         
-        # Build conversation history for Claude
-        # First message always includes the image
-        messages = []
+        messages = _build_messages(session, user_message)
         
-        # Add conversation history (without image in follow-ups to save tokens)
-        for msg in session["conversation_history"]:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        # Call Claude API (rate-limited, transient errors retried)
+        async def call_claude():
+            async with anthropic_limiter:
+                return await client.messages.create(
+                    model=MODEL_NAME,
+                    max_tokens=MAX_TOKENS,
+                    messages=messages
+                )
         
-        # Add current user message with image reference
-        # Include image in every request to maintain context
-        current_content = [
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": session["media_type"],
-                    "data": session["image_base64"],
-                },
-            },
-            {
-                "type": "text",
-                "text": user_message
-            }
-        ]
-        
-        messages.append({
-            "role": "user",
-            "content": current_content
-        })
-        
-        # Call Claude API
-        response = client.messages.create(
-            model=MODEL_NAME,
-            max_tokens=MAX_TOKENS,
-            messages=messages
-        )
+        response = await with_retry(call_claude)
         
         assistant_reply = response.content[0].text.strip()
         
         # Add to conversation history
-        session["conversation_history"].append({
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        session["conversation_history"].append({
-            "role": "assistant",
-            "content": assistant_reply,
-            "timestamp": datetime.now().isoformat()
-        })
+        await _record_turn(session, user_message, assistant_reply)
         
         logger.info(f"✅ Image chat response generated for session {session_id[:8]}...")
         
@@ -227,14 +351,111 @@ async def chat_with_image(session_id: str, user_message: str) -> Dict:
         }
 
 
+def _build_messages(session: Dict, user_message: str) -> List[Dict]:
+    """
+    Build the Claude messages for a new turn.
+    The image always rides on the first user message, marked as a prompt-cache
+    breakpoint, so every turn shares the same image prefix and follow-ups within
+    the cache window don't pay full price for the image tokens again.
+    """
+    image_block = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": session["media_type"],
+            "data": base64.standard_b64encode(session["image_bytes"]).decode("ascii"),
+        },
+        "cache_control": {"type": "ephemeral"}
+    }
+    
+    turns = [(msg["role"], msg["content"]) for msg in session["conversation_history"]]
+    turns.append(("user", user_message))
+    
+    messages = []
+    for i, (role, content) in enumerate(turns):
+        if i == 0:
+            content = [image_block, {"type": "text", "text": content}]
+        messages.append({"role": role, "content": content})
+    
+    return messages
+
+
+async def _record_turn(session: Dict, user_message: str, assistant_reply: str) -> None:
+    """Append a completed user/assistant exchange to the session history."""
+    turn = [
+        {
+            "role": "user",
+            "content": user_message,
+            "timestamp": time.time_ns()
+        },
+        {
+            "role": "assistant",
+            "content": assistant_reply,
+            "timestamp": time.time_ns()
+        }
+    ]
+    session["conversation_history"].extend(turn)
+    await _store_turn(session["session_id"], turn)
+
+
+async def stream_chat_with_image(session_id: str, user_message: str) -> AsyncIterator[str]:
+    """
+    Streaming variant of chat_with_image.
+    
+    Args:
+        session_id: Unique session ID
+        user_message: User's question about the image
+        
+    Returns:
+        Async iterator of reply text chunks
+        
+    Raises:
+        ValueError: If the session does not exist (before streaming starts)
+    """
+    session = await _load_session(session_id)
+    if session is None:
+        raise ValueError("Session not found. Please upload an image first.")
+    
+    return _stream_reply(session, user_message)
+
+
+async def _stream_reply(session: Dict, user_message: str) -> AsyncIterator[str]:
+    """Stream Claude's reply; the turn is recorded only if the stream completes."""
+    if not client:
+        yield "⚠️ Anthropic API key not configured. Please add ANTHROPIC_API_KEY to your .env file."
+        return
+    
+    messages = _build_messages(session, user_message)
+    chunks = []
+    
+    try:
+        async with anthropic_limiter:
+            async with client.messages.stream(
+                model=MODEL_NAME,
+                max_tokens=MAX_TOKENS,
+                messages=messages
+            ) as stream:
+                async for text in stream.text_stream:
+                    chunks.append(text)
+                    yield text
+    
+    except Exception as e:
+        logger.error(f"❌ Image chat stream error: {e}")
+        if not chunks:
+            yield f"⚠️ Error: {str(e)}"
+        return  # Incomplete replies are not recorded
+    
+    await _record_turn(session, user_message, "".join(chunks).strip())
+
+
 async def get_session_info(session_id: str) -> Dict:
     """
     Get information about an image chat session.
     """
-    if session_id not in image_chat_sessions:
+    session = await _load_session(session_id)
+    if session is None:
         return None
     
-    session = image_chat_sessions[session_id]
     return {
         "session_id": session_id,
         "filename": session["filename"],
@@ -248,8 +469,18 @@ async def delete_session(session_id: str) -> bool:
     """
     Delete an image chat session.
     """
-    if session_id in image_chat_sessions:
-        del image_chat_sessions[session_id]
+    with _sessions_lock:
+        removed = image_chat_sessions.pop(session_id, None)
+    
+    redis = get_redis()
+    if redis is not None:
+        try:
+            if await redis.delete(*_session_keys(session_id)):
+                removed = True
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to delete image session {session_id} from Redis: {e}")
+    
+    if removed is not None:
         logger.info(f"🗑️ Deleted image chat session {session_id}")
         return True
     return False
\ No newline at end of file
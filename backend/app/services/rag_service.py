@@ -4,11 +4,16 @@ RAG (Retrieval-Augmented Generation) service.
 Handles text embedding, chunking, vector storage, and semantic search.
 """
 import os
+import hashlib
+import numpy as np
 from typing import List, Dict, Optional
 from sentence_transformers import SentenceTransformer
 from qdrant_client.models import PointStruct, Filter, FieldCondition, MatchValue
+from app.database.qdrant_batcher import get_search_batcher
+from app.services.embedding_batcher import get_embedding_batcher
 import logging
 from dotenv import load_dotenv
+from cachetools import LRUCache
 import uuid
 
 load_dotenv()
@@ -16,9 +21,20 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# torch | torch_compile | onnx | openvino (onnx/openvino need sentence-transformers[onnx] / [openvino])
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# ONNX file inside the model repo, e.g. onnx/model_qint8_avx512_vnni.onnx for int8 on CPU
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")
 CHUNK_SIZE = 500  # Characters per chunk
 CHUNK_OVERLAP = 50  # Overlap between chunks
 DEFAULT_COLLECTION = "multimodal_docs"
+UPSERT_BATCH_SIZE = 256  # Points per upload request
+_WORD_BOUNDARIES = frozenset(" \n\t.,")  # Chunk ends here without cutting a word
+
+# Recently embedded chunks by content hash (boilerplate repeats across uploads);
+# ~1.5 KB per 384-dim float32 vector
+CHUNK_EMBEDDING_CACHE_SIZE = int(os.getenv("CHUNK_EMBEDDING_CACHE_SIZE", "10000"))
+_chunk_embeddings = LRUCache(maxsize=CHUNK_EMBEDDING_CACHE_SIZE)
 
 # Load embedding model (cached globally)
 _embedding_model = None
@@ -33,9 +49,9 @@ def get_embedding_model() -> SentenceTransformer:
     
     if _embedding_model is None:
         try:
-            logger.info(f"📥 Loading embedding model: {EMBEDDING_MODEL_NAME}")
-            _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-            logger.info(f"✅ Embedding model loaded: {EMBEDDING_MODEL_NAME}")
+            logger.info(f"📥 Loading embedding model: {EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND})")
+            _embedding_model = _load_embedding_model()
+            logger.info(f"✅ Embedding model loaded: {EMBEDDING_MODEL_NAME} on {_embedding_model.device}")
         except Exception as e:
             logger.error(f"❌ Failed to load embedding model: {e}")
             raise
@@ -43,6 +59,28 @@ def get_embedding_model() -> SentenceTransformer:
     return _embedding_model
 
 
+def _load_embedding_model() -> SentenceTransformer:
+    """
+    Build the model for EMBEDDING_BACKEND.
+    ONNX/OpenVINO use the exported graphs (sentence-transformers exports on
+    first load if the repo has none); torch runs in fp16 on GPU.
+    """
+    if EMBEDDING_BACKEND in ("onnx", "openvino"):
+        model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, backend=EMBEDDING_BACKEND, model_kwargs=model_kwargs)
+    
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    if model.device.type == "cuda":
+        model.half()  # Embeddings are cast back to float32 by the batcher
+    
+    if EMBEDDING_BACKEND == "torch_compile":
+        import torch
+        
+        model[0].auto_model = torch.compile(model[0].auto_model, dynamic=True)
+    
+    return model
+
+
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """
     Split text into overlapping chunks.
@@ -58,28 +96,32 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVE
     if len(text) <= chunk_size:
         return [text]
     
+    # Character offsets of every space, found in one NumPy pass
+    # (UTF-32 gives exactly one uint32 per character)
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    spaces = np.flatnonzero(codes == 0x20)
+    
     chunks = []
     start = 0
     
     while start < len(text):
         end = start + chunk_size
-        chunk = text[start:end]
         
-        # Avoid cutting words in half
-        if end < len(text) and text[end] not in [' ', '\n', '\t', '.', ',']:
-            # Find last space before end
-            last_space = chunk.rfind(' ')
-            if last_space > 0:
-                end = start + last_space
-                chunk = text[start:end]
+        # Avoid cutting words in half: back up to the last space in the window
+        if end < len(text) and text[end] not in _WORD_BOUNDARIES:
+            i = np.searchsorted(spaces, end) - 1
+            if i >= 0 and spaces[i] > start:
+                end = int(spaces[i])
+        
+        chunks.append(text[start:end].strip())
         
-        chunks.append(chunk.strip())
-        start = end - overlap
+        # Always advance; drop the overlap if it would not move past start
+        start = end - overlap if end - overlap > start else end
     
     return chunks
 
 
-def embed_text(text: str) -> List[float]:
+def embed_text(text: str) -> np.ndarray:
     """
     Generate embedding vector for text.
     
@@ -87,14 +129,19 @@ def embed_text(text: str) -> List[float]:
         text: Text to embed
         
     Returns:
-        384-dimensional embedding vector
+        384-dimensional L2-normalized float32 embedding vector
+        (required: the collection uses DOT distance)
     """
     model = get_embedding_model()
-    embedding = model.encode(text, convert_to_numpy=True)
-    return embedding.tolist()
+    return model.encode(
+        text,
+        convert_to_numpy=True,
+        convert_to_tensor=False,
+        normalize_embeddings=True
+    ).astype(np.float32, copy=False)  # fp16 models return float16
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+def embed_texts(texts: List[str]) -> np.ndarray:
     """
     Generate embedding vectors for multiple texts (batch processing).
     
@@ -102,11 +149,17 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
         texts: List of texts to embed
         
     Returns:
-        List of 384-dimensional embedding vectors
+        (len(texts), 384) float32 array of L2-normalized embedding vectors
+        (required: the collection uses DOT distance)
     """
     model = get_embedding_model()
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=len(texts) > 10)
-    return embeddings.tolist()
+    return model.encode(
+        texts,
+        convert_to_numpy=True,
+        convert_to_tensor=False,
+        normalize_embeddings=True,
+        show_progress_bar=len(texts) > 10
+    ).astype(np.float32, copy=False)
 
 
 async def upsert_document(
@@ -121,7 +174,7 @@ async def upsert_document(
     Chunk text, embed, and upsert to Qdrant with user_id filtering.
     
     Args:
-        qdrant_client: Qdrant client instance
+        qdrant_client: Async Qdrant client instance
         user_id: User ID for access control
         file_id: Unique file identifier
         text: Text content to process
@@ -134,37 +187,40 @@ async def upsert_document(
     try:
         # Chunk text
         chunks = chunk_text(text)
+        hashes = [_chunk_hash(chunk) for chunk in chunks]
         logger.info(f"📄 Split document into {len(chunks)} chunks")
         
-        # Generate embeddings (batch process for efficiency)
-        embeddings = embed_texts(chunks)
-        logger.info(f"🔢 Generated {len(embeddings)} embeddings")
+        # Generate embeddings off the event loop, batched with concurrent
+        # uploads and searches
+        # NOTE: vectors must be L2-normalized; the collection scores with DOT
+        embeddings = await _embed_chunks(chunks, hashes)
         
-        # Prepare points for Qdrant
-        points = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            point_id = str(uuid.uuid4())
-            
-            payload = {
-                "user_id": user_id,
-                "file_id": file_id,
-                "chunk_index": i,
-                "text": chunk,
-                **(metadata or {})
-            }
-            
-            point = PointStruct(
-                id=point_id,
-                vector=embedding,
-                payload=payload
+        # Prepare points for Qdrant; models validate vectors as lists of
+        # floats, so arrays are converted only here, at the client boundary
+        points = [
+            PointStruct(
+                id=str(uuid.uuid4()),
+                vector=embedding.tolist(),
+                payload={
+                    "user_id": user_id,
+                    "file_id": file_id,
+                    "chunk_index": i,
+                    "chunk_hash": chunk_hash,
+                    "text": chunk,
+                    **(metadata or {})
+                }
             )
-            points.append(point)
+            for i, (chunk, chunk_hash, embedding) in enumerate(zip(chunks, hashes, embeddings))
+        ]
         
-        # Upsert to Qdrant
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=points
-        )
+        # Upsert in batches without waiting for indexing, so no single huge
+        # request holds the connection (async client: awaited, not threaded)
+        for start in range(0, len(points), UPSERT_BATCH_SIZE):
+            await qdrant_client.upsert(
+                collection_name=collection_name,
+                points=points[start:start + UPSERT_BATCH_SIZE],
+                wait=False
+            )
         
         logger.info(f"✅ Upserted {len(points)} vectors to Qdrant (file_id={file_id})")
         
@@ -179,6 +235,36 @@ async def upsert_document(
         raise
 
 
+def _chunk_hash(chunk: str) -> str:
+    """BLAKE2b-128 hex digest of a chunk's text."""
+    return hashlib.blake2b(chunk.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+async def _embed_chunks(chunks: List[str], hashes: List[str]) -> List[np.ndarray]:
+    """
+    Embed a document's chunks, skipping repeats: identical chunks within the
+    document are embedded once, and recently embedded ones come from the cache.
+    """
+    vectors = {}
+    missing = {}
+    for chunk, chunk_hash in zip(chunks, hashes):
+        if chunk_hash in vectors or chunk_hash in missing:
+            continue
+        vector = _chunk_embeddings.get(chunk_hash)
+        if vector is None:
+            missing[chunk_hash] = chunk
+        else:
+            vectors[chunk_hash] = vector
+    
+    if missing:
+        computed = await get_embedding_batcher().embed_many(list(missing.values()))
+        for chunk_hash, vector in zip(missing, computed):
+            vectors[chunk_hash] = _chunk_embeddings[chunk_hash] = vector
+    
+    logger.info(f"🔢 Generated {len(missing)} embeddings ({len(chunks) - len(missing)} chunks reused)")
+    return [vectors[chunk_hash] for chunk_hash in hashes]
+
+
 async def search_similar(
     qdrant_client,
     user_id: str,
@@ -190,7 +276,7 @@ async def search_similar(
     Search for similar text chunks with user_id filtering.
     
     Args:
-        qdrant_client: Qdrant client instance
+        qdrant_client: Async Qdrant client instance
         user_id: User ID for access control (REQUIRED)
         query: Search query text
         limit: Maximum number of results
@@ -200,14 +286,16 @@ async def search_similar(
         List of matching chunks with scores and metadata
     """
     try:
-        # Embed query
-        query_embedding = embed_text(query)
+        # Embed query (batched with concurrent searches; L2-normalized for DOT)
+        query_embedding = await get_embedding_batcher().embed(query)
         logger.info(f"🔍 Searching for: '{query[:50]}...'")
         
         # Search with user_id filter (SECURITY: prevents cross-user data access)
-        results = qdrant_client.search(
+        # Concurrent searches are coalesced into one query_batch_points call
+        results = await get_search_batcher().search(
+            qdrant_client,
             collection_name=collection_name,
-            query_vector=query_embedding,
+            vector=query_embedding.tolist(),
             query_filter=Filter(
                 must=[
                     FieldCondition(
@@ -216,8 +304,7 @@ async def search_similar(
                     )
                 ]
             ),
-            limit=limit,
-            with_payload=True
+            limit=limit
         )
         
         # Format results
@@ -253,7 +340,7 @@ async def delete_user_vectors(
     Delete vectors for a user (optionally filtered by file_id).
     
     Args:
-        qdrant_client: Qdrant client instance
+        qdrant_client: Async Qdrant client instance
         user_id: User ID
         file_id: Optional file ID to delete specific file only
         collection_name: Qdrant collection name
@@ -273,7 +360,7 @@ async def delete_user_vectors(
             )
         
         # Delete points matching filter
-        qdrant_client.delete(
+        await qdrant_client.delete(
             collection_name=collection_name,
             points_selector=Filter(must=filter_conditions)
         )
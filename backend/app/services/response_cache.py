@@ -0,0 +1,103 @@
+# backend/app/services/response_cache.py
+"""
+Response cache for chat.
+Returns a stored reply when a user repeats a message (same text after
+normalization) in the same conversation and conversational context.
+"""
+import hashlib
+import logging
+from typing import Dict, List, Optional
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+CACHE_TTL = 24 * 3600  # seconds
+MAX_ENTRIES = 16384  # cached replies kept across all conversations
+
+
+class ResponseCache:
+    """
+    Cache of replies keyed by (user, conversation, context, normalized message).
+    Exact matches only: near-duplicates ("delete file 3" vs "delete file 4")
+    embed almost identically but need different answers.
+    Only touched from the event loop, so no lock is needed.
+    """
+
+    def __init__(self):
+        self._replies = TTLCache(maxsize=MAX_ENTRIES, ttl=CACHE_TTL)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context_key(history: List[Dict]) -> str:
+        """Short hash of the last exchange, so cached replies only match in the same context."""
+        tail = "\x00".join(msg.get("content", "") for msg in history[-2:])
+        return hashlib.sha256(tail.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Casefold and collapse whitespace so trivial edits still match."""
+        return " ".join(message.casefold().split())
+
+    def lookup(
+        self,
+        user_id: str,
+        conversation_id: str,
+        context_key: str,
+        message: str
+    ) -> Optional[str]:
+        """
+        Find a cached reply for a repeated message.
+
+        Args:
+            user_id: User ID
+            conversation_id: Conversation ID (cache is scoped per conversation)
+            context_key: Hash from context_key()
+            message: User's message
+
+        Returns:
+            Cached reply, or None on a miss
+        """
+        reply = self._replies.get((user_id, conversation_id, context_key, self.normalize(message)))
+        if reply is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        logger.info(f"⚡ Response cache hit (hit rate={self.hit_rate:.1%})")
+        return reply
+
+    def store(
+        self,
+        user_id: str,
+        conversation_id: str,
+        context_key: str,
+        message: str,
+        reply: str
+    ) -> None:
+        """Remember a reply for a later repeat of the same message."""
+        self._replies[(user_id, conversation_id, context_key, self.normalize(message))] = reply
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# Singleton instance
+_response_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Get singleton response cache.
+    Initializes on first call, returns cached instance thereafter.
+    """
+    global _response_cache
+
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+
+    return _response_cache
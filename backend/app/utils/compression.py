@@ -0,0 +1,40 @@
+# backend/app/utils/compression.py
+"""
+Response compression middleware.
+Starlette's GZipMiddleware, minus content types that must not be gzipped.
+"""
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.types import Message, Receive, Scope, Send
+
+# Event streams must reach the client per event (gzip buffers them);
+# WebP/PNG/JPEG plots and images are already compressed
+EXCLUDED_CONTENT_TYPES = ("text/event-stream", "image/")
+
+
+class _SelectiveGZipResponder(GZipResponder):
+    """GZipResponder that passes excluded content types through untouched."""
+
+    async def send_with_gzip(self, message: Message) -> None:
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(EXCLUDED_CONTENT_TYPES):
+                # Same pass-through path GZipResponder uses for pre-encoded bodies
+                self.content_encoding_set = True
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """
+    GZip responses except event streams and images.
+    Use in place of GZipMiddleware; takes the same arguments.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _SelectiveGZipResponder(
+                self.app, self.minimum_size, compresslevel=self.compresslevel
+            )
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,42 @@
+# backend/app/utils/context_window.py
+"""
+Context window utilities - Pick recent messages that fit a token budget.
+Tokens are estimated from characters (~3 chars/token; use 2 for CJK-heavy text).
+"""
+import os
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+CHARS_PER_TOKEN = int(os.getenv("CONTEXT_CHARS_PER_TOKEN", "3"))
+
+
+def recent_within_budget(
+    history: Sequence[T],
+    token_budget: int,
+    content: Callable[[T], str]
+) -> List[T]:
+    """
+    Select the newest messages whose combined content fits the budget.
+    
+    Args:
+        history: Messages in chronological order (list or deque)
+        token_budget: Approximate token budget for the selected messages
+        content: Function returning a message's text
+    
+    Returns:
+        Selected messages in chronological order
+    """
+    char_budget = token_budget * CHARS_PER_TOKEN
+    selected = []
+    used = 0
+    
+    # Walk newest → oldest until the next message would overflow the budget
+    for msg in reversed(history):
+        used += len(content(msg))
+        if used > char_budget:
+            break
+        selected.append(msg)
+    
+    selected.reverse()
+    return selected
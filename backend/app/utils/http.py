@@ -0,0 +1,118 @@
+# backend/app/utils/http.py
+"""
+Shared HTTP client utilities.
+One pooled HTTP/2 httpx.AsyncClient per process, reused across requests.
+"""
+import logging
+import os
+from typing import IO
+import httpx
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+# Connection pool configuration
+HTTP_TIMEOUT = 30.0
+HTTP_CONNECT_TIMEOUT = 5.0  # Fail fast on unreachable hosts
+HTTP_MAX_CONNECTIONS = 128
+HTTP_MAX_KEEPALIVE = 32
+READ_CHUNK_SIZE = 1 << 20  # 1 MiB per streamed chunk
+
+# Remote CSV limits
+MAX_CSV_BYTES = int(os.getenv("MAX_CSV_BYTES", str(100 * 1024 * 1024)))
+REJECTED_CONTENT_TYPES = ("text/html",)  # Error/login pages, not CSV
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Create the process-wide HTTP client.
+    Keep-alive + HTTP/2 avoid a TCP/TLS handshake per outbound fetch.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE
+        )
+    )
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """FastAPI dependency returning the shared client created on startup."""
+    return request.app.state.http
+
+
+async def fetch_csv(http: httpx.AsyncClient, url: str, dest: IO[bytes]) -> int:
+    """
+    Stream a remote CSV into a writable binary file.
+    
+    Args:
+        http: Shared pooled client
+        url: CSV URL
+        dest: Binary file to write into (e.g. a SpooledTemporaryFile)
+    
+    Returns:
+        Number of bytes written
+    
+    Raises:
+        HTTPException: 400 on a non-200 response, non-CSV content or network error,
+            413 if the CSV exceeds MAX_CSV_BYTES, 504 on timeout
+    """
+    try:
+        # Cheap pre-check; servers that don't support HEAD are checked on GET
+        head = await http.head(url)
+        if head.status_code == 200:
+            _check_headers(head)
+        
+        async with http.stream("GET", url) as response:
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Failed to fetch CSV from URL: {response.status_code}"
+                )
+            _check_headers(response)
+            
+            written = 0
+            async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_CSV_BYTES:
+                    raise _too_large()
+                dest.write(chunk)
+            
+            return written
+    
+    except httpx.TimeoutException as e:
+        logger.error(f"❌ Timed out fetching CSV: {e}")
+        raise HTTPException(
+            status_code=504,
+            detail="Timed out fetching CSV from URL"
+        )
+    except httpx.RequestError as e:
+        logger.error(f"❌ Error fetching CSV: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to fetch CSV: {str(e)}"
+        )
+
+
+def _check_headers(response: httpx.Response) -> None:
+    """Reject oversized or non-CSV responses before reading the body."""
+    content_type = response.headers.get("content-type", "").lower()
+    if content_type.startswith(REJECTED_CONTENT_TYPES):
+        raise HTTPException(
+            status_code=400,
+            detail=f"URL does not point to a CSV file (content-type: {content_type})"
+        )
+    
+    content_length = response.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_CSV_BYTES:
+        raise _too_large()
+
+
+def _too_large() -> HTTPException:
+    """413 for CSVs over the configured size cap."""
+    return HTTPException(
+        status_code=413,
+        detail=f"CSV exceeds the {MAX_CSV_BYTES // (1024 * 1024)} MB limit"
+    )
@@ -4,126 +4,352 @@ JWT verification utilities for Supabase Auth.
 Supports both RSA (RS256) and EC (ES256) keys.
 """
 import os
+import re
+import asyncio
 import jwt
-import requests
+import time
+import hashlib
+import threading
+import httpx
 from typing import Optional
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from functools import lru_cache
+from cachetools import LRUCache, TTLCache
 import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# RSA/EC key support needs the cryptography package (a PyJWT extra)
+try:
+    from jwt.algorithms import RSAAlgorithm, ECAlgorithm
+except ImportError:
+    RSAAlgorithm = ECAlgorithm = None
+    logger.warning("⚠️ cryptography not installed: RS256/ES256 tokens cannot be verified")
+
 # Environment configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_JWT_AUD = os.getenv("SUPABASE_JWT_AUD", "authenticated")
 
+# Expected claims, fixed at startup (verify_jwt rejects requests before
+# they are used if SUPABASE_URL is unset)
+_ISSUER = f"{SUPABASE_URL.rstrip('/')}/auth/v1" if SUPABASE_URL else ""
+_AUDIENCE = SUPABASE_JWT_AUD
+
 # Security scheme for FastAPI docs
 security = HTTPBearer()
 
+# Compact JWS shape: three base64url segments (header.payload.signature).
+# Checked in one pass so malformed tokens never reach base64/JSON decoding
+_JWT_RE = re.compile(r"[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+")
+_BEARER_RE = re.compile(r"Bearer (" + _JWT_RE.pattern + r")")
+
+# Verified token payloads keyed by a BLAKE2b-128 digest of the token (valid until 'exp')
+VERIFIED_TOKEN_CACHE_SIZE = 4096
+_verified_tokens = LRUCache(maxsize=VERIFIED_TOKEN_CACHE_SIZE)
+_verified_tokens_lock = threading.Lock()
+
+# Public keys parsed from the JWKS, by kid. from_jwk validates the key through
+# OpenSSL (slow), so each kid is parsed once per process; only kids present
+# in the JWKS are stored, so this stays as small as the key set.
+# Values are cryptography key objects (never JWK dicts or PEM strings):
+# PyJWT's prepare_key passes those through without re-validating them
+_signing_keys = {}
+_signing_keys_lock = threading.Lock()
+
+
+def _token_key(token: str) -> bytes:
+    """
+    Cache key for a token (fixed size, raw token is never stored).
+    Hashes the whole token, not just the signature, so a hit always means
+    the exact bytes that were verified.
+    """
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+def get_cached_payload(token: str) -> Optional[dict]:
+    """
+    Return the verified payload for a token seen before, if it hasn't expired.
+    
+    Args:
+        token: JWT token string
+        
+    Returns:
+        Cached payload, or None if the token must be verified
+    """
+    token_hash = _token_key(token)
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(token_hash)
+        if cached is None:
+            return None
+        if cached.get("exp", 0) > time.time():
+            return cached
+        _verified_tokens.pop(token_hash, None)
+    return None
+
 
-@lru_cache(maxsize=1)
 def get_jwks_url() -> str:
     """Get JWKS URL for Supabase project."""
     if not SUPABASE_URL:
         raise ValueError("SUPABASE_URL not configured in environment")
     
-    base_url = SUPABASE_URL.rstrip('/')
-    return f"{base_url}/auth/v1/.well-known/jwks.json"
+    return f"{_ISSUER}/.well-known/jwks.json"
 
 
-@lru_cache(maxsize=1)
 def get_issuer() -> str:
     """Get expected JWT issuer for Supabase project."""
     if not SUPABASE_URL:
         raise ValueError("SUPABASE_URL not configured in environment")
     
-    base_url = SUPABASE_URL.rstrip('/')
-    return f"{base_url}/auth/v1"
+    return _ISSUER
+
+
+# JWKS freshness: served from memory until REFRESH_AFTER, then refreshed in the
+# background while the stale copy keeps serving; only past HARD_TTL (or on the
+# first call) does a request wait for the fetch
+JWKS_REFRESH_AFTER = 300  # seconds
+JWKS_HARD_TTL = 3600  # seconds
+JWKS_MIN_REFETCH_INTERVAL = 30  # seconds between forced refetches (unknown kid)
+JWKS_RETRY_AFTER = 10  # seconds after a failed fetch before trying again
+
+# Kids that matched no usable key after a refetch; their tokens are rejected
+# without touching the JWKS until the entry expires (event loop only)
+_unknown_kids = TTLCache(maxsize=1024, ttl=JWKS_MIN_REFETCH_INTERVAL)
+
+# Pooled HTTP/2 client for JWKS fetches (TLS session reused across refreshes)
+_jwks_http = None
+
+
+def _get_jwks_http() -> httpx.AsyncClient:
+    """Get the JWKS HTTP client, creating it on first use."""
+    global _jwks_http
+    
+    if _jwks_http is None:
+        _jwks_http = httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=4)
+        )
+    return _jwks_http
+
+
+async def close_jwks_client() -> None:
+    """Close the JWKS client's connection pool."""
+    global _jwks_http
+    
+    if _jwks_http is not None:
+        await _jwks_http.aclose()
+    _jwks_http = None
 
 
-@lru_cache(maxsize=1)
-def fetch_jwks() -> dict:
+class JWKSCache:
     """
-    Fetch JWKS (JSON Web Key Set) from Supabase.
-    Cached for performance.
+    JWKS holder with refresh-ahead.
+    Used from the event loop only; fetches are awaited, never blocking.
     """
-    try:
-        jwks_url = get_jwks_url()
-        logger.info(f"Fetching JWKS from: {jwks_url}")
-        
-        response = requests.get(jwks_url, timeout=10)
-        response.raise_for_status()
+    
+    def __init__(self, refresh_after: float = JWKS_REFRESH_AFTER, hard_ttl: float = JWKS_HARD_TTL):
+        self.refresh_after = refresh_after
+        self.hard_ttl = hard_ttl
+        self._jwks = None
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+        self._failed_at: float | None = None
+    
+    async def get(self, force_refresh: bool = False) -> dict:
+        """
+        Return the JWKS, fetching only when it is missing, past the hard TTL,
+        or force_refresh is set (at most once per JWKS_MIN_REFETCH_INTERVAL).
+        """
+        age = time.monotonic() - self._fetched_at
+        jwks = self._jwks
         
-        jwks = response.json()
-        logger.info(f"✅ JWKS fetched successfully ({len(jwks.get('keys', []))} keys)")
-        return jwks
+        if jwks is not None:
+            if force_refresh and age >= JWKS_MIN_REFETCH_INTERVAL:
+                return await self._fetch_blocking(max_age=JWKS_MIN_REFETCH_INTERVAL)
+            if age < self.refresh_after:
+                return jwks
+            if age < self.hard_ttl:
+                self._start_refresh()
+                return jwks
         
-    except Exception as e:
-        logger.error(f"❌ Failed to fetch JWKS: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to fetch authentication keys"
-        )
+        return await self._fetch_blocking(max_age=self.refresh_after)
+    
+    def _recently_failed(self) -> bool:
+        """Whether the last fetch failed less than JWKS_RETRY_AFTER ago."""
+        return self._failed_at is not None and time.monotonic() - self._failed_at < JWKS_RETRY_AFTER
+    
+    def _start_refresh(self) -> None:
+        """Refresh in a background task unless one is running or just failed."""
+        if self._recently_failed():
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+    
+    async def _refresh(self) -> None:
+        """Background refresh; on failure the cached keys keep serving."""
+        try:
+            jwks = await _download_jwks()
+            self._jwks, self._fetched_at, self._failed_at = jwks, time.monotonic(), None
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            logger.warning(f"⚠️ Background JWKS refresh failed, keeping cached keys: {e}")
+    
+    async def _fetch_blocking(self, max_age: float) -> dict:
+        """
+        Fetch under the lock; callers that queued behind a fetch reuse its result.
+        After a failure, requests get the stale keys (or fail fast without any)
+        for JWKS_RETRY_AFTER instead of each retrying the fetch.
+        """
+        async with self._lock:
+            if self._jwks is not None and time.monotonic() - self._fetched_at < max_age:
+                return self._jwks
+            
+            if not self._recently_failed():
+                try:
+                    jwks = await _download_jwks()
+                    self._jwks, self._fetched_at, self._failed_at = jwks, time.monotonic(), None
+                    return jwks
+                except Exception as e:
+                    self._failed_at = time.monotonic()
+                    logger.error(f"❌ Failed to fetch JWKS: {e}")
+            
+            if self._jwks is not None:
+                return self._jwks  # Stale, but keys rarely change; better than failing every request
+            
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to fetch authentication keys"
+            )
+
+
+async def _download_jwks() -> dict:
+    """GET the JWKS document from Supabase."""
+    jwks_url = get_jwks_url()
+    logger.info(f"Fetching JWKS from: {jwks_url}")
+    
+    response = await _get_jwks_http().get(jwks_url)
+    response.raise_for_status()
+    
+    jwks = response.json()
+    # Indexed once per fetch; a refresh swaps the whole dict, index included
+    jwks["keys_by_kid"] = {key["kid"]: key for key in jwks.get("keys", []) if "kid" in key}
+    logger.info(f"✅ JWKS fetched successfully ({len(jwks.get('keys', []))} keys)")
+    return jwks
+
+
+_jwks_cache = JWKSCache()
+
+
+async def fetch_jwks(force_refresh: bool = False) -> dict:
+    """
+    Fetch JWKS (JSON Web Key Set) from Supabase.
+    Cached with refresh-ahead (see JWKSCache).
+    
+    Args:
+        force_refresh: Refetch now (rate-limited), e.g. for an unknown kid after key rotation
+    """
+    return await _jwks_cache.get(force_refresh)
 
 
-def get_signing_key(token: str) -> Optional[any]:
+async def preload_jwks() -> None:
+    """
+    Fetch the JWKS and parse every key at startup, so the first
+    authenticated request doesn't pay for the round trip or from_jwk.
+    No-op without SUPABASE_URL.
+    """
+    if not SUPABASE_URL:
+        return
+    
+    jwks = await fetch_jwks()
+    for kid in jwks["keys_by_kid"]:
+        public_key = await _load_key_for_kid(kid)
+        if public_key is not None:
+            with _signing_keys_lock:
+                _signing_keys[kid] = public_key
+    
+    logger.info(f"✅ Preloaded {len(_signing_keys)} JWT signing keys")
+
+
+async def get_signing_key_by_header(unverified_header: dict) -> Optional[any]:
     """
     Get the signing key for JWT verification from JWKS.
     Supports both RSA (RS256) and EC (ES256) keys.
     
     Args:
-        token: JWT token string
+        unverified_header: Token header from jwt.get_unverified_header()
         
     Returns:
         Public key or None
     """
     try:
-        # Decode header without verification to get kid and alg
-        unverified_header = jwt.get_unverified_header(token)
         kid = unverified_header.get("kid")
         
         if not kid:
             logger.warning("⚠️ JWT missing 'kid' in header")
             return None
         
-        # Get JWKS
-        jwks = fetch_jwks()
+        with _signing_keys_lock:
+            public_key = _signing_keys.get(kid)
+        if public_key is not None:
+            return public_key
         
-        # Find matching key
-        for key in jwks.get("keys", []):
-            if key.get("kid") == kid:
-                # Get algorithm from key
-                alg = key.get("alg", "RS256")
-                
-                logger.info(f"🔑 Found matching key: kid={kid}, alg={alg}")
-                
-                # Convert JWK to public key based on algorithm
-                if alg.startswith("RS"):
-                    # RSA key
-                    from jwt.algorithms import RSAAlgorithm
-                    public_key = RSAAlgorithm.from_jwk(key)
-                    return public_key
-                elif alg.startswith("ES"):
-                    # Elliptic Curve key
-                    from jwt.algorithms import ECAlgorithm
-                    public_key = ECAlgorithm.from_jwk(key)
-                    return public_key
-                else:
-                    logger.warning(f"⚠️ Unsupported algorithm: {alg}")
-                    return None
+        if kid in _unknown_kids:
+            return None
         
-        logger.warning(f"⚠️ No matching key found for kid: {kid}")
-        return None
+        public_key = await _load_key_for_kid(kid)
+        if public_key is not None:
+            with _signing_keys_lock:
+                _signing_keys[kid] = public_key
+        else:
+            _unknown_kids[kid] = True
+        return public_key
         
     except Exception as e:
         logger.error(f"❌ Error getting signing key: {e}")
         return None
 
 
-def verify_jwt(token: str) -> dict:
+async def _load_key_for_kid(kid: str) -> Optional[any]:
+    """
+    Find the JWK for a kid in the JWKS and parse it into a public key.
+    
+    Args:
+        kid: Key ID from the token header
+        
+    Returns:
+        Public key or None
+    """
+    # Get JWKS; an unknown kid may be a newly rotated key, so refetch once
+    key = (await fetch_jwks())["keys_by_kid"].get(kid)
+    if key is None:
+        key = (await fetch_jwks(force_refresh=True))["keys_by_kid"].get(kid)
+    
+    if key is None:
+        logger.warning(f"⚠️ No matching key found for kid: {kid}")
+        return None
+    
+    # Get algorithm from key
+    alg = key.get("alg", "RS256")
+    
+    logger.info(f"🔑 Found matching key: kid={kid}, alg={alg}")
+    
+    # Convert JWK to public key based on algorithm (key validation is
+    # CPU-bound, so it runs in a worker thread)
+    if alg.startswith("RS") and RSAAlgorithm is not None:
+        # RSA key
+        return await asyncio.to_thread(RSAAlgorithm.from_jwk, key)
+    elif alg.startswith("ES") and ECAlgorithm is not None:
+        # Elliptic Curve key
+        return await asyncio.to_thread(ECAlgorithm.from_jwk, key)
+    else:
+        logger.warning(f"⚠️ Unsupported algorithm: {alg}")
+        return None
+
+
+async def verify_jwt(token: str) -> dict:
     """
     Verify Supabase JWT token using JWKS.
     Supports both RS256 (RSA) and ES256 (Elliptic Curve) algorithms.
@@ -143,32 +369,55 @@ def verify_jwt(token: str) -> dict:
             detail="Supabase not configured. Please set SUPABASE_URL in environment."
         )
     
+    # Fast path: token already verified and not yet expired
+    cached = get_cached_payload(token)
+    if cached is not None:
+        return cached
+    
+    if not _JWT_RE.fullmatch(token):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token"
+        )
+    
+    # Decode the header once; its kid selects the key, its alg the algorithm
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.InvalidTokenError as e:
+        logger.warning(f"⚠️ Invalid token: {e}")
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token"
+        )
+    algorithm = unverified_header.get("alg", "RS256")
+    
+    # Key lookup awaits the JWKS fetch on the event loop; the signature
+    # check is CPU-bound, so it runs in a worker thread
+    signing_key = await get_signing_key_by_header(unverified_header)
+    return await asyncio.to_thread(_decode_token, token, signing_key, algorithm)
+
+
+def _decode_token(token: str, signing_key: Optional[any], algorithm: str) -> dict:
+    """
+    Check a token's signature and claims against its signing key.
+    
+    Raises:
+        HTTPException: 401 if token is invalid
+    """
     try:
-        # Get signing key
-        signing_key = get_signing_key(token)
-        
         if not signing_key:
             raise HTTPException(
                 status_code=401,
                 detail="Unable to verify token: signing key not found"
             )
         
-        # Get expected issuer
-        expected_issuer = get_issuer()
-        
-        # Detect algorithm from token header
-        unverified_header = jwt.get_unverified_header(token)
-        algorithm = unverified_header.get("alg", "RS256")
-        
-        logger.info(f"🔐 Verifying token with algorithm: {algorithm}")
-        
         # Verify and decode JWT
         payload = jwt.decode(
             token,
             signing_key,
             algorithms=[algorithm],  # Use detected algorithm
-            audience=SUPABASE_JWT_AUD,
-            issuer=expected_issuer,
+            audience=_AUDIENCE,
+            issuer=_ISSUER,
             options={
                 "verify_signature": True,
                 "verify_exp": True,
@@ -184,7 +433,15 @@ def verify_jwt(token: str) -> dict:
                 detail="Invalid token: missing 'sub' claim"
             )
         
-        logger.info(f"✅ JWT verified for user: {payload['sub'][:8]}...")
+        # Per-request log: gated so the f-string isn't built unless DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"✅ JWT verified for user: {payload['sub'][:8]}... ({algorithm})")
+        
+        # Cache only tokens with an expiry so entries can't outlive the token
+        if "exp" in payload:
+            with _verified_tokens_lock:
+                _verified_tokens[_token_key(token)] = payload
+        
         return payload
         
     except jwt.ExpiredSignatureError:
@@ -230,8 +487,9 @@ async def get_current_user(
     """
     token = credentials.credentials
     
-    # Verify JWT and extract payload
-    payload = verify_jwt(token)
+    # Repeat tokens are answered from the cache; a miss awaits the JWKS fetch
+    # and checks the signature in a worker thread
+    payload = await verify_jwt(token)
     
     # Extract user_id from 'sub' claim
     user_id = payload.get("sub")
@@ -246,7 +504,7 @@ async def get_current_user(
 
 
 # Backward compatibility
-def verify_bearer_or_401(request) -> dict:
+async def verify_bearer_or_401(request) -> dict:
     """Legacy function for backward compatibility."""
     auth_header = request.headers.get("Authorization")
     
@@ -256,17 +514,16 @@ def verify_bearer_or_401(request) -> dict:
             detail="Missing Authorization header"
         )
     
-    if not auth_header.startswith("Bearer "):
+    match = _BEARER_RE.fullmatch(auth_header)
+    if match is None:
         raise HTTPException(
             status_code=401,
             detail="Invalid Authorization header format"
         )
     
-    token = auth_header.replace("Bearer ", "")
-    payload = verify_jwt(token)
+    payload = await verify_jwt(match.group(1))
     
     return {
         "user_id": payload.get("sub"),
-        "email": payload.get("email"),
-        "token": token[:20] + "..."
+        "email": payload.get("email")
     }
\ No newline at end of file
@@ -0,0 +1,108 @@
+# backend/app/utils/micro_batcher.py
+"""
+Base class for micro-batching layers.
+Callers submit payloads and await futures; one background worker drains the
+queue in batches and hands each batch to the subclass's _flush().
+"""
+import asyncio
+import itertools
+import logging
+from typing import Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Queue + background worker that groups concurrent requests into batches.
+    Subclasses implement _flush(batch) and must resolve every future in it.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait: float):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: asyncio.PriorityQueue | None = None
+        self._worker: asyncio.Task | None = None
+        self._seq = itertools.count()  # FIFO order within a priority
+
+    def _ensure_worker(self) -> None:
+        """Start (or restart) the background worker on the running event loop."""
+        # The queue outlives the worker, so requests queued before a restart
+        # are still served by the new worker
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _submit(self, payload: Any, priority: int = 0) -> asyncio.Future:
+        """
+        Queue a payload and return the future its batch will resolve.
+        Lower priority values are batched first, so latency-sensitive
+        requests don't wait behind a backlog of bulk work.
+        """
+        self._ensure_worker()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._seq), payload, future))
+        return future
+
+    async def _get(self) -> Tuple[Any, asyncio.Future]:
+        """Pop the most urgent pending request."""
+        _, _, payload, future = await self._queue.get()
+        return payload, future
+
+    async def _run(self) -> None:
+        """Pop pending requests and flush them in batches."""
+        batch: List[Tuple[Any, asyncio.Future]] = []
+        try:
+            while True:
+                batch = [await self._get()]
+
+                # Collect more requests arriving within the window
+                deadline = asyncio.get_running_loop().time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - asyncio.get_running_loop().time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                await self._flush(batch)
+                batch = []
+        except asyncio.CancelledError:
+            self._fail(batch, RuntimeError(f"{type(self).__name__} stopped"))
+            raise
+        except Exception as e:
+            # A bug in _flush must not strand callers; the next submit restarts the worker
+            logger.error(f"❌ {type(self).__name__} worker crashed: {e}")
+            self._fail(batch, e)
+
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Process one batch of (payload, future) pairs."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _fail(batch: List[Tuple[Any, asyncio.Future]], error: BaseException) -> None:
+        """Resolve every still-pending future in a batch with an error."""
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self) -> None:
+        """Stop the background worker and fail any requests still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        if self._queue is not None:
+            pending = []
+            while not self._queue.empty():
+                _, _, payload, future = self._queue.get_nowait()
+                pending.append((payload, future))
+            self._fail(pending, RuntimeError(f"{type(self).__name__} closed"))
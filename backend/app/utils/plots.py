@@ -3,11 +3,45 @@
 Plot utilities - Convert matplotlib figures to base64 strings.
 """
 import base64
+import asyncio
 from io import BytesIO
-import matplotlib.pyplot as plt
+from typing import TYPE_CHECKING
 
+# matplotlib is imported on first use: callers already hold a Figure, and
+# workers that never plot skip its import time and memory
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-def fig_to_base64(fig: plt.Figure) -> str:
+
+def _pyplot():
+    """Import pyplot with the Agg backend pinned (headless server: no GUI backend)."""
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_figure(fig: "Figure") -> "FigureCanvasAgg":
+    """
+    Make sure the figure draws through an Agg canvas of its own.
+    Figures built without pyplot get one attached once, instead of savefig
+    creating a throwaway canvas on every call.
+    
+    Args:
+        fig: Matplotlib figure object
+        
+    Returns:
+        The figure's Agg canvas
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    if not isinstance(fig.canvas, FigureCanvasAgg):
+        FigureCanvasAgg(fig)
+    return fig.canvas
+
+
+def fig_to_base64(fig: "Figure") -> str:
     """
     Convert a matplotlib figure to base64-encoded PNG string.
     
@@ -28,9 +62,24 @@ def fig_to_base64(fig: plt.Figure) -> str:
         # Use in HTML: <img src="data:image/png;base64,{base64_str}" />
     """
     buffer = BytesIO()
-    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=100)
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-    buffer.close()
-    plt.close(fig)
-    return image_base64
\ No newline at end of file
+    render_figure(fig)
+    # Fast zlib level: these are inlined as data URIs, so encode time matters more than size
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=100, pil_kwargs={"compress_level": 1})
+    _pyplot().close(fig)
+    # getvalue() hands over the PNG without a seek/read copy
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+async def fig_to_base64_async(fig: "Figure") -> str:
+    """
+    Async variant of fig_to_base64 for async endpoints.
+    Rendering and PNG compression run in a worker thread, so the event loop
+    keeps serving other requests meanwhile.
+    
+    Args:
+        fig: Matplotlib figure object (not touched by the caller until this returns)
+        
+    Returns:
+        Base64-encoded string of the PNG image
+    """
+    return await asyncio.to_thread(fig_to_base64, fig)
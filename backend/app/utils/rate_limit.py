@@ -0,0 +1,125 @@
+# backend/app/utils/rate_limit.py
+"""
+Rate limiting utilities for upstream model APIs (Gemini, Claude).
+Caps concurrent calls and requests per minute, and retries transient errors
+with exponential backoff instead of letting 429 storms reach users.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, TypeVar
+import anthropic
+import httpx
+from google.genai import errors as genai_errors
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying (timeout, rate limit, transient 5xx, Anthropic overload)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0  # seconds, doubled per attempt
+
+
+class AsyncRateLimiter:
+    """
+    Concurrency cap (semaphore) plus a requests-per-minute token bucket.
+    Use as `async with limiter:` around a single upstream call.
+    """
+    
+    def __init__(self, max_concurrency: int, requests_per_minute: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._capacity = float(requests_per_minute)
+        self._rate = requests_per_minute / 60.0  # tokens per second
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def _take_token(self) -> None:
+        """Wait until the bucket has a token, then consume it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+    
+    async def __aenter__(self) -> "AsyncRateLimiter":
+        await self._semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+    
+    async def __aexit__(self, *exc) -> None:
+        self._semaphore.release()
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether an upstream error is transient (rate limit / overload / 5xx / timeout).
+    Classified by exception type and status code, never by message text.
+    """
+    # Network-level failures: nothing reached (or came back from) the API
+    if isinstance(error, (httpx.TimeoutException, anthropic.APIConnectionError)):
+        return True
+    
+    if isinstance(error, anthropic.RateLimitError):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, genai_errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    
+    return False
+
+
+async def with_retry(
+    call: Callable[[], Awaitable[T]],
+    retries: int = MAX_RETRIES,
+    base_delay: float = RETRY_DELAY
+) -> T:
+    """
+    Await call(), retrying transient errors with exponential backoff.
+    
+    Args:
+        call: Zero-argument coroutine factory (a fresh coroutine per attempt)
+        retries: Total attempts
+        base_delay: First backoff delay in seconds
+    
+    Returns:
+        Result of the first successful attempt
+    
+    Raises:
+        The last error if it is not retryable or attempts are exhausted
+    """
+    for attempt in range(retries):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries - 1 or not is_retryable(e):
+                raise
+            
+            wait_time = base_delay * (2 ** attempt)
+            logger.warning(f"⏳ Upstream error (attempt {attempt + 1}/{retries}), retrying in {wait_time}s: {e}")
+            await asyncio.sleep(wait_time)
+
+
+# Shared limiters (per process)
+gemini_limiter = AsyncRateLimiter(
+    max_concurrency=int(os.getenv("GEMINI_CONCURRENCY", "8")),
+    requests_per_minute=int(os.getenv("GEMINI_RPM", "60"))
+)
+anthropic_limiter = AsyncRateLimiter(
+    max_concurrency=int(os.getenv("ANTHROPIC_CONCURRENCY", "4")),
+    requests_per_minute=int(os.getenv("ANTHROPIC_RPM", "50"))
+)
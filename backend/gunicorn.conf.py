@@ -0,0 +1,15 @@
+# backend/gunicorn.conf.py
+"""
+Gunicorn settings for production (Linux).
+Run from backend/: gunicorn app.main:app
+"""
+import os
+
+# Load the app (and the embedding model) once in the parent process, so the
+# model's weights are shared copy-on-write across forked workers
+preload_app = True
+os.environ.setdefault("PRELOAD_MODEL", "1")
+
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
@@ -8,7 +8,7 @@ type InputMode = 'url' | 'file';
 interface Message {
   role: 'user' | 'assistant';
   content: string;
-  plot_base64?: string;
+  plot_url?: string;
   timestamp: string;
 }
 
@@ -134,8 +134,9 @@ export default function CsvPanel() {
       });
 
       const data = response.data;
-      // Update with full conversation history from backend
-      setMessages(data.conversation_history);
+      // Backend returns only recent history; swap the temp message for the new turn
+      const latestTurn: Message[] = data.conversation_history.slice(-2);
+      setMessages((prev) => [...prev.slice(0, -1), ...latestTurn]);
     } catch (err: any) {
       console.error('Send message error:', err);
       const errorMsg: Message = {
@@ -340,10 +341,10 @@ export default function CsvPanel() {
               <div className="whitespace-pre-wrap break-words">{msg.content}</div>
 
               {/* Plot Image */}
-              {msg.plot_base64 && (
+              {msg.plot_url && (
                 <div className="mt-3">
                   <img
-                    src={`data:image/png;base64,${msg.plot_base64}`}
+                    src={`${apiClient.defaults.baseURL}${msg.plot_url}`}
                     alt="Visualization"
                     className="max-w-full rounded border border-gray-300"
                   />